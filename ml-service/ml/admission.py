@@ -0,0 +1,144 @@
+"""
+Admission control for the Course Recommendation System
+Caps concurrent scoring requests and sheds load once a short wait queue is full
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from config import API_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class AdmissionController:
+    """Concurrency limiter with a bounded, time-limited wait queue.
+
+    Up to max_concurrent requests run at once. Further requests wait for a slot, but at
+    most max_queued of them and for at most queue_timeout seconds each; anything beyond
+    that is refused immediately so the caller can shed it instead of slowing down every
+    request in flight. Background work such as bulk exports uses acquire_background,
+    which waits as long as it takes, outside the queue and behind every queued request.
+    """
+
+    def __init__(self, max_concurrent: int = None, max_queued: int = None, queue_timeout: float = None):
+        self.max_concurrent = max_concurrent or API_CONFIG['max_concurrent_requests']
+        self.max_queued = API_CONFIG['admission_queue_size'] if max_queued is None else max_queued
+        self.queue_timeout = API_CONFIG['admission_queue_timeout_seconds'] if queue_timeout is None else queue_timeout
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)  # Queued requests
+        self._background_cond = threading.Condition(self._lock)  # Background work waiting for an idle slot
+        self.in_flight = 0
+        self.queued = 0
+        self.background_waiting = 0
+        self.peak_in_flight = 0
+        self.counters = {
+            'admitted': 0,
+            'admitted_after_wait': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'degraded': 0,  # Refused requests answered from the cache or popularity instead
+            'admitted_background': 0
+        }
+        self.wait_seconds_total = 0.0
+        self.background_wait_seconds_total = 0.0
+
+    def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if needed; False means the request should be shed"""
+        with self._cond:
+            # Requests already waiting go first
+            if self.in_flight < self.max_concurrent and self.queued == 0:
+                self._admit()
+                return True
+
+            if self.queued >= self.max_queued:
+                self.counters['rejected_queue_full'] += 1
+                return False
+
+            self.queued += 1
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['rejected_timeout'] += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.queued -= 1
+                self.wait_seconds_total += time.monotonic() - start
+                if self.queued == 0:
+                    self._background_cond.notify()
+
+            self._admit()
+            self.counters['admitted_after_wait'] += 1
+            return True
+
+    def acquire_background(self):
+        """Take a slot for work that can wait, blocking until one is free and no request is queued.
+        
+        Never refused, so nothing is counted as a rejection, and the wait does not take a
+        place in the queue interactive requests use.
+        """
+        with self._cond:
+            self.background_waiting += 1
+            start = time.monotonic()
+            try:
+                while self.in_flight >= self.max_concurrent or self.queued > 0:
+                    self._background_cond.wait()
+            finally:
+                self.background_waiting -= 1
+                self.background_wait_seconds_total += time.monotonic() - start
+            
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.counters['admitted_background'] += 1
+    
+    def _admit(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.counters['admitted'] += 1
+
+    def release(self):
+        """Give back a slot taken by acquire or acquire_background; queued requests get it first"""
+        with self._cond:
+            self.in_flight -= 1
+            if self.queued:
+                self._cond.notify()
+            else:
+                self._background_cond.notify()
+
+    @contextmanager
+    def admit(self) -> Iterator[bool]:
+        """Yield whether the request was admitted, releasing its slot afterwards"""
+        admitted = self.acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def record_degraded(self):
+        with self._cond:
+            self.counters['degraded'] += 1
+
+    def stats(self) -> Dict:
+        """In-flight and queued gauges plus admission counters"""
+        with self._cond:
+            counters = dict(self.counters)
+            waited = counters['admitted_after_wait'] + counters['rejected_timeout']
+            return {
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'background_waiting': self.background_waiting,
+                'peak_in_flight': self.peak_in_flight,
+                'max_concurrent': self.max_concurrent,
+                'max_queued': self.max_queued,
+                **counters,
+                'wait_seconds_avg': self.wait_seconds_total / waited if waited else 0.0,
+                'background_wait_seconds_total': self.background_wait_seconds_total
+            }
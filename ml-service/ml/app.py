@@ -8,12 +8,12 @@ import sys
 import json
 import logging
 from datetime import datetime, timedelta
-from threading import Thread
+from threading import Thread, Lock
 import time
 import traceback
 from typing import Dict, List, Optional
 
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest, InternalServerError
 import schedule
@@ -22,9 +22,14 @@ import atexit
 # Add current directory to path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import API_CONFIG, TRAINING_CONFIG, REFRESH_CONFIG, LOGGING_CONFIG
+from config import API_CONFIG, MODEL_CONFIG, TRAINING_CONFIG, REFRESH_CONFIG, LOGGING_CONFIG, INGESTION_CONFIG, SNAPSHOT_CONFIG, SERVING_CONFIG
 from core import DatabaseManager, HybridRecommender, IncrementalRecommender
+from ingestion import ActivityIngestor, ActivityLog
+from cache import RecommendationCache
+from admission import AdmissionController
+from snapshot import TrainingSnapshot, TrainingDataContext
 from evaluation import ModelEvaluator
+import metrics
 
 # Setup logging
 logging.basicConfig(
@@ -43,14 +48,33 @@ CORS(app)
 
 # Global variables
 db_manager = None
+training_snapshot = None
 recommender = None
 incremental_recommender = None
+# Activity events are folded into whichever model is published when their batch is applied
+activity_ingestor = ActivityIngestor(lambda: incremental_recommender)
+recommendation_cache = RecommendationCache()
+admission = AdmissionController()  # Caps concurrent scoring on the recommendation endpoints
+training_lock = Lock()  # Only one training run builds a candidate model at a time
 scheduler_thread = None
 shutdown_flag = False
+# 'standalone' trains and serves in one process; under serving.py workers only serve and one trainer process trains
+process_role = 'standalone'
+
+# Read from the components' own counters at scrape time
+metrics.CACHE_HITS.set_function(lambda: recommendation_cache.stats()['hits'])
+metrics.CACHE_MISSES.set_function(lambda: recommendation_cache.stats()['misses'])
+metrics.CACHE_HIT_RATIO.set_function(lambda: recommendation_cache.stats()['hit_ratio'])
+metrics.CACHE_ENTRIES.set_function(lambda: recommendation_cache.stats()['entries'])
+metrics.ADMISSION_IN_FLIGHT.set_function(lambda: admission.stats()['in_flight'])
+metrics.ADMISSION_QUEUED.set_function(lambda: admission.stats()['queued'])
+metrics.ADMISSION_REJECTED.set_function(
+    lambda: admission.stats()['rejected_queue_full'] + admission.stats()['rejected_timeout']
+)
 
 def initialize_system():
     """Initialize the recommendation system"""
-    global db_manager, recommender, incremental_recommender
+    global db_manager, training_snapshot
     
     try:
         logger.info("Initializing recommendation system...")
@@ -61,25 +85,34 @@ def initialize_system():
         
         # Initialize database manager
         db_manager = DatabaseManager()
+        if SNAPSHOT_CONFIG['enabled']:
+            training_snapshot = TrainingSnapshot(db_manager)
         
         # Load or create model
         model_path = TRAINING_CONFIG['model_path']
+        legacy_path = TRAINING_CONFIG['legacy_model_path']
+        loaded = None
         
-        if os.path.exists(model_path):
+        if HybridRecommender.has_artifact(model_path):
             logger.info(f"Loading existing model from {model_path}")
-            recommender = HybridRecommender.load_model(model_path, db_manager)
-            
-            if recommender is None:
-                logger.warning("Failed to load existing model, creating new one")
-                recommender = HybridRecommender(db_manager)
-                train_model()
+            loaded = HybridRecommender.load_model(model_path, db_manager)
+        elif os.path.exists(legacy_path):
+            logger.info(f"Converting legacy model {legacy_path} to {model_path}")
+            loaded = HybridRecommender.load_model(legacy_path, db_manager)
+            if loaded is not None:
+                loaded.save_model(model_path)
         else:
             logger.info("No existing model found, creating new one")
-            recommender = HybridRecommender(db_manager)
+        
+        if loaded is None:
+            logger.warning("No usable model loaded, training a new one")
+            # Serve 'not ready' from an untrained placeholder until training publishes a model
+            publish_model(HybridRecommender(db_manager))
             train_model()
+        else:
+            publish_model(loaded)
         
-        # Initialize incremental recommender
-        incremental_recommender = IncrementalRecommender(recommender)
+        activity_ingestor.start()
         
         logger.info("System initialized successfully")
         return True
@@ -89,49 +122,209 @@ def initialize_system():
         logger.error(traceback.format_exc())
         return False
 
-def train_model():
-    """Train the recommendation model"""
-    global recommender
+def initialize_worker():
+    """Initialize a serving worker of the prefork server.
+    
+    Workers never train. They memory-map the artifact the trainer process publishes, so
+    the model arrays sit in the page cache once however many workers attach, and a
+    watcher thread swaps in each new version as it appears.
+    """
+    global db_manager, process_role
     
     try:
-        logger.info("Starting model training...")
+        logger.info(f"Initializing serving worker {os.getpid()}...")
+        process_role = 'worker'
+        os.makedirs("logs", exist_ok=True)
         
-        if recommender is None:
-            logger.error("Recommender not initialized")
-            return False
+        db_manager = DatabaseManager()
+        
+        # Serve 'not ready' until the trainer has published a first artifact
+        publish_model(HybridRecommender(db_manager))
+        reload_model_artifact()
+        
+        # Each worker receives only part of the activity; the shared log carries the rest
+        activity_ingestor.activity_log = ActivityLog(INGESTION_CONFIG['shared_log_dir'])
+        activity_ingestor.start()
+        Thread(target=watch_model_artifact, name='artifact-watcher', daemon=True).start()
+        metrics.enable_multiprocess(SERVING_CONFIG['metrics_dir'], SERVING_CONFIG['metrics_flush_seconds'])
+        
+        logger.info(f"Serving worker {os.getpid()} initialized")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Failed to initialize serving worker: {e}")
+        logger.error(traceback.format_exc())
+        return False
+
+def initialize_trainer():
+    """Initialize the training process of the prefork server: it owns snapshot syncs, retrains and the artifact"""
+    global db_manager, training_snapshot, process_role
+    
+    try:
+        logger.info("Initializing training process...")
+        process_role = 'trainer'
+        os.makedirs("logs", exist_ok=True)
+        os.makedirs("ml", exist_ok=True)
+        metrics.enable_multiprocess(SERVING_CONFIG['metrics_dir'], SERVING_CONFIG['metrics_flush_seconds'])
         
-        # Train the model
-        recommender.train()
+        db_manager = DatabaseManager()
+        if SNAPSHOT_CONFIG['enabled']:
+            training_snapshot = TrainingSnapshot(db_manager)
         
-        # Save the trained model
         model_path = TRAINING_CONFIG['model_path']
-        backup_path = TRAINING_CONFIG['backup_model_path']
+        legacy_path = TRAINING_CONFIG['legacy_model_path']
+        if not HybridRecommender.has_artifact(model_path):
+            converted = None
+            if os.path.exists(legacy_path):
+                logger.info(f"Converting legacy model {legacy_path} to {model_path}")
+                converted = HybridRecommender.load_model(legacy_path, db_manager)
+            
+            if converted is not None:
+                converted.save_model(model_path)
+            else:
+                logger.warning("No model artifact found, training a new one")
+                train_model()
         
-        # Create backup of existing model
-        if os.path.exists(model_path):
-            try:
-                os.rename(model_path, backup_path)
-                logger.info(f"Backed up existing model to {backup_path}")
-            except Exception as e:
-                logger.warning(f"Failed to backup model: {e}")
+        logger.info("Training process initialized")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Failed to initialize training process: {e}")
+        logger.error(traceback.format_exc())
+        return False
+
+def reload_model_artifact() -> bool:
+    """Publish the artifact version CURRENT names if it is not the one being served"""
+    model_path = TRAINING_CONFIG['model_path']
+    if not HybridRecommender.has_artifact(model_path):
+        return False
+    
+    version = os.path.basename(HybridRecommender.artifact_version_dir(model_path))
+    model = recommender
+    if model is not None and model.model_version == version:
+        return False
+    
+    loaded = HybridRecommender.load_model(model_path, db_manager)
+    if loaded is None:
+        return False
+    
+    publish_model(loaded)
+    return True
+
+def watch_model_artifact():
+    """Poll the artifact directory and swap in each newly published version"""
+    while not shutdown_flag:
+        time.sleep(SERVING_CONFIG['artifact_poll_seconds'])
+        try:
+            reload_model_artifact()
+        except Exception as e:
+            logger.error(f"Failed to reload model artifact: {e}")
+
+def retrain_request_path() -> str:
+    """File a worker creates to ask the trainer process for a retrain"""
+    return os.path.join(TRAINING_CONFIG['model_path'], 'RETRAIN')
+
+def run_requested_training():
+    """Trainer job: retrain if a worker asked for it since the last check"""
+    path = retrain_request_path()
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info("Retrain requested by a serving worker")
+        scheduled_training()
+
+def publish_model(new_recommender: HybridRecommender):
+    """Make a fully built model the one requests use.
+    
+    Handlers read the global once per request, so in-flight requests finish on the
+    model they started with and new requests see the new one.
+    """
+    global recommender, incremental_recommender
+    
+    previous_incremental = incremental_recommender
+    incremental_recommender = IncrementalRecommender(new_recommender, on_fold_in=recommendation_cache.invalidate_user)
+    recommender = new_recommender
+    
+    # Entries are keyed by model version, so the old model's are unreachable now; free them
+    recommendation_cache.clear()
+    
+    update_model_metrics(new_recommender)
+    
+    # Activity folded into the old model after training started reading data is not in the new one
+    if previous_incremental is not None and new_recommender.training_started_at is not None:
+        missed = previous_incremental.activities_since(new_recommender.training_started_at)
+        incremental_recommender.replay(missed)
+        if missed:
+            logger.info(f"Replayed {len(missed)} activities onto the new model")
+    
+    logger.info(f"Published model version {new_recommender.model_version}")
+
+def update_model_metrics(model: HybridRecommender):
+    """Point the model gauges at a newly published model"""
+    metrics.MODEL_PUBLISHED_TIMESTAMP.set(time.time())
+    if model.training_seconds is not None:
+        metrics.MODEL_TRAINING_SECONDS.set(model.training_seconds)
+    
+    model_path = TRAINING_CONFIG['model_path']
+    try:
+        if HybridRecommender.has_artifact(model_path):
+            artifact = HybridRecommender.artifact_info(model_path)
+            if artifact['model_version'] == model.model_version:
+                metrics.MODEL_SIZE_BYTES.set(artifact['size_bytes'])
+    except Exception as e:
+        logger.error(f"Failed to read model artifact size: {e}")
+
+def train_model(evaluate: bool = False):
+    """Train a fresh model off the request path and swap it in when complete, optionally evaluating it"""
+    if not training_lock.acquire(blocking=False):
+        logger.info("Model training already in progress, skipping")
+        return False
+    
+    try:
+        logger.info("Starting model training...")
         
-        # Save new model
-        recommender.save_model(model_path)
+        # Training checks connections out of the shared pool, in parallel with request threads;
+        # the bulk tables are read from the local snapshot after pulling what changed since its last sync
+        source = db_manager
+        if training_snapshot is not None:
+            training_snapshot.sync()
+            source = training_snapshot
+        
+        # Training and the evaluation that follows share one fetch of each dataset
+        with TrainingDataContext(source) as data:
+            candidate = HybridRecommender(data)
+            candidate.train()
+            
+            # Save the trained model as a new artifact version; the previous version stays on disk as the backup
+            candidate.save_model(TRAINING_CONFIG['model_path'])
+            
+            publish_model(candidate)
+            
+            # Workers only need shared activity from after the new model started reading data
+            if process_role == 'trainer':
+                ActivityLog.prune(INGESTION_CONFIG['shared_log_dir'], candidate.training_started_at)
+            
+            logger.info("Model training completed successfully")
+            
+            if evaluate:
+                run_evaluation(data)
         
-        logger.info("Model training completed successfully")
         return True
         
     except Exception as e:
         logger.error(f"Model training failed: {e}")
         logger.error(traceback.format_exc())
         return False
+    
+    finally:
+        training_lock.release()
 
-def run_evaluation():
+def run_evaluation(data_source=None):
     """Run model evaluation and log results"""
     try:
         logger.info("Running model evaluation...")
         
-        evaluator = ModelEvaluator(recommender, db_manager)
+        model = recommender
+        evaluator = ModelEvaluator(model, data_source or db_manager)
         report = evaluator.generate_evaluation_report()
         
         # Save evaluation report
@@ -155,10 +348,8 @@ def scheduled_training():
     logger.info("Starting scheduled model training...")
     
     try:
-        # Train model
-        if train_model():
-            # Run evaluation after training
-            run_evaluation()
+        # Train model, then evaluate it on the same data
+        if train_model(evaluate=True):
             logger.info("Scheduled training completed successfully")
         else:
             logger.error("Scheduled training failed")
@@ -167,21 +358,40 @@ def scheduled_training():
         logger.error(f"Scheduled training error: {e}")
         logger.error(traceback.format_exc())
 
+def sync_snapshot():
+    """Pull rows changed since the last sync into the training snapshot"""
+    try:
+        training_snapshot.sync()
+    except Exception as e:
+        logger.error(f"Training snapshot sync failed: {e}")
+
 def setup_scheduler():
     """Setup the training scheduler"""
     global scheduler_thread, shutdown_flag
     
-    # Schedule daily training at 2 AM
-    schedule.every().day.at("02:00").do(scheduled_training)
+    # Activity is folded in as it arrives; full retrains only run on the full_retrain_hours schedule
+    retrain_hours = REFRESH_CONFIG['full_retrain_hours']
+    if retrain_hours == 24:
+        schedule.every().day.at("02:00").do(scheduled_training)
+    else:
+        schedule.every(retrain_hours).hours.do(scheduled_training)
+    
+    # Keep the snapshot close to the database so a retrain only fetches the last few minutes of changes
+    if training_snapshot is not None:
+        schedule.every(REFRESH_CONFIG['incremental_update_minutes']).minutes.do(sync_snapshot)
+    
+    # Serving workers ask for manual retrains through a request file
+    if process_role == 'trainer':
+        schedule.every(SERVING_CONFIG['artifact_poll_seconds']).seconds.do(run_requested_training)
     
     def run_scheduler():
         while not shutdown_flag:
             schedule.run_pending()
-            time.sleep(60)  # Check every minute
+            time.sleep(1)  # Check every second
     
     scheduler_thread = Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
-    logger.info("Training scheduler started - will run daily at 2:00 AM")
+    logger.info(f"Training scheduler started - full retrain every {retrain_hours} hours")
 
 def cleanup_on_exit():
     """Cleanup function to be called on exit"""
@@ -190,6 +400,8 @@ def cleanup_on_exit():
     logger.info("Shutting down recommendation system...")
     shutdown_flag = True
     
+    activity_ingestor.stop()
+    
     if db_manager:
         db_manager.close()
     
@@ -205,9 +417,13 @@ def before_request():
 
 @app.after_request
 def after_request(response):
-    """Log request completion"""
+    """Log request completion and record its latency"""
     duration = time.time() - g.start_time
     logger.info(f"{request.method} {request.path} - {response.status_code} - {duration:.3f}s")
+    
+    # The route template, not the path, so user ids do not become label values
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(duration, method=request.method, route=route, status=response.status_code)
     return response
 
 @app.errorhandler(400)
@@ -235,7 +451,8 @@ def health_check():
         db_manager.ensure_connection()
         
         # Check model status
-        model_status = "loaded" if recommender and recommender.is_trained else "not_loaded"
+        model = recommender
+        model_status = "loaded" if model and model.is_trained else "not_loaded"
         
         return jsonify({
             'status': 'healthy',
@@ -252,6 +469,47 @@ def health_check():
             'error': str(e)
         }), 500
 
+def shed_request(model: HybridRecommender, user_ids: List[int], n_recommendations: int, batch_cached: Dict = None):
+    """Answer a request refused by admission control.
+    
+    With degrade_when_saturated, students get their cached lists or popular courses they
+    are not enrolled in, marked as degraded; otherwise the client is told to retry later.
+    batch_cached holds the lists the batch endpoint already found in the cache and is
+    None for the single-user endpoint.
+    """
+    if not API_CONFIG['degrade_when_saturated']:
+        response = jsonify({
+            'error': 'Service saturated',
+            'message': 'Too many concurrent recommendation requests, retry shortly',
+            'timestamp': datetime.now().isoformat()
+        })
+        response.headers['Retry-After'] = str(API_CONFIG['admission_retry_after_seconds'])
+        return response, 503
+    
+    admission.record_degraded()
+    recommendations = dict(batch_cached or {})
+    for user_id in user_ids:
+        if str(user_id) not in recommendations:
+            recommendations[str(user_id)] = model.get_popular_recommendations(user_id, n_recommendations)
+    
+    if batch_cached is None:
+        user_recommendations = recommendations[str(user_ids[0])]
+        return jsonify({
+            'user_id': user_ids[0],
+            'recommendations': user_recommendations,
+            'n_recommendations': len(user_recommendations),
+            'degraded': True,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return jsonify({
+        'recommendations': recommendations,
+        'successful_users': len(recommendations),
+        'failed_users': [],
+        'degraded': True,
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/recommendations/<int:user_id>', methods=['GET'])
 def get_recommendations(user_id):
     """Get recommendations for a specific user"""
@@ -265,20 +523,32 @@ def get_recommendations(user_id):
         if n_recommendations <= 0 or n_recommendations > 20:
             raise BadRequest("n_recommendations must be between 1 and 20")
         
+        # Use one model for the whole request, even if retraining publishes a new one meanwhile
+        model = recommender
+        
         # Check if model is ready
-        if not recommender or not recommender.is_trained:
+        if not model or not model.is_trained:
             return jsonify({
                 'error': 'Model not ready',
                 'message': 'Recommendation model is not trained yet',
                 'timestamp': datetime.now().isoformat()
             }), 503
         
-        # Get recommendations
-        recommendations = recommender.get_recommendations(user_id, n_recommendations)
+        # Serve from the cache when this model already answered for the student
+        recommendations = recommendation_cache.get(user_id, n_recommendations, model.model_version)
+        if recommendations is None:
+            with admission.admit() as admitted:
+                if not admitted:
+                    return shed_request(model, [user_id], n_recommendations)
+                
+                generation = recommendation_cache.generation(user_id)
+                recommendations = model.get_recommendations(user_id, n_recommendations)
+                recommendation_cache.put(user_id, n_recommendations, model.model_version, recommendations, generation)
         
         # Log user activity for incremental learning
-        if incremental_recommender:
-            incremental_recommender.update_with_new_activity(user_id, 'api_request')
+        incremental = incremental_recommender
+        if incremental:
+            incremental.update_with_new_activity(user_id, 'api_request')
         
         return jsonify({
             'user_id': user_id,
@@ -307,37 +577,53 @@ def get_batch_recommendations():
         if not isinstance(user_ids, list) or not user_ids:
             raise BadRequest("user_ids must be a non-empty list")
         
-        if len(user_ids) > 50:
-            raise BadRequest("Maximum 50 users per batch request")
+        if not all(isinstance(user_id, int) for user_id in user_ids):
+            raise BadRequest("user_ids must be integers")
+        
+        if len(user_ids) > API_CONFIG['max_batch_users']:
+            raise BadRequest(f"Maximum {API_CONFIG['max_batch_users']} users per batch request")
         
         n_recommendations = data.get('n_recommendations', 5)
         if n_recommendations <= 0 or n_recommendations > 20:
             raise BadRequest("n_recommendations must be between 1 and 20")
         
+        # Use one model for the whole request, even if retraining publishes a new one meanwhile
+        model = recommender
+        
         # Check if model is ready
-        if not recommender or not recommender.is_trained:
+        if not model or not model.is_trained:
             return jsonify({
                 'error': 'Model not ready',
                 'message': 'Recommendation model is not trained yet',
                 'timestamp': datetime.now().isoformat()
             }), 503
         
-        # Get recommendations for each user
+        # Answer cached students directly and score the rest together
         batch_recommendations = {}
         failed_users = []
         
-        for user_id in user_ids:
-            try:
-                recommendations = recommender.get_recommendations(user_id, n_recommendations)
-                batch_recommendations[str(user_id)] = recommendations
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = recommendation_cache.get(user_id, n_recommendations, model.model_version)
+            if cached is None:
+                misses.append(user_id)
+            else:
+                batch_recommendations[str(user_id)] = cached
+        
+        if misses:
+            with admission.admit() as admitted:
+                if not admitted:
+                    return shed_request(model, user_ids, n_recommendations, batch_recommendations)
                 
-                # Log activity for incremental learning
-                if incremental_recommender:
-                    incremental_recommender.update_with_new_activity(user_id, 'api_request')
-                    
-            except Exception as e:
-                logger.warning(f"Failed to get recommendations for user {user_id}: {e}")
-                failed_users.append(user_id)
+                try:
+                    generations = {user_id: recommendation_cache.generation(user_id) for user_id in misses}
+                    results = model.get_recommendations_batch(misses, n_recommendations)
+                    for user_id, recs in results.items():
+                        recommendation_cache.put(user_id, n_recommendations, model.model_version, recs, generations[user_id])
+                        batch_recommendations[str(user_id)] = recs
+                except Exception as e:
+                    logger.warning(f"Failed to get batch recommendations for {len(misses)} users: {e}")
+                    failed_users = misses
         
         return jsonify({
             'recommendations': batch_recommendations,
@@ -353,9 +639,102 @@ def get_batch_recommendations():
         logger.error(traceback.format_exc())
         raise InternalServerError("Failed to generate batch recommendations")
 
+@app.route('/recommendations/bulk', methods=['POST'])
+def stream_bulk_recommendations():
+    """Stream recommendations for a large set of students as NDJSON, one student per line.
+    
+    The body lists user_ids, or gives a cohort: {"department_id": ..., "course_id": ...}
+    selects the students enrolled in that department's courses and/or that course. Rows are
+    written chunk by chunk as they are scored, and the last line summarizes the run, so a
+    stream without it was cut short.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or ('user_ids' in data) == ('cohort' in data):
+            raise BadRequest("Either user_ids or cohort required in request body")
+        
+        n_recommendations = data.get('n_recommendations', 5)
+        if not isinstance(n_recommendations, int) or n_recommendations <= 0 or n_recommendations > 20:
+            raise BadRequest("n_recommendations must be between 1 and 20")
+        
+        if 'user_ids' in data:
+            user_ids = data['user_ids']
+            if not isinstance(user_ids, list) or not all(isinstance(user_id, int) for user_id in user_ids):
+                raise BadRequest("user_ids must be a list of integers")
+            if len(user_ids) > API_CONFIG['max_bulk_users']:
+                raise BadRequest(f"Maximum {API_CONFIG['max_bulk_users']} users per bulk request")
+            user_ids = list(dict.fromkeys(user_ids))
+        else:
+            cohort = data['cohort']
+            if (not isinstance(cohort, dict) or not cohort
+                    or not set(cohort) <= {'department_id', 'course_id'}
+                    or not all(isinstance(value, int) for value in cohort.values())):
+                raise BadRequest("cohort must give an integer department_id and/or course_id")
+        
+        # Use one model for the whole stream, even if retraining publishes a new one meanwhile
+        model = recommender
+        
+        # Check if model is ready
+        if not model or not model.is_trained:
+            return jsonify({
+                'error': 'Model not ready',
+                'message': 'Recommendation model is not trained yet',
+                'timestamp': datetime.now().isoformat()
+            }), 503
+        
+        if 'cohort' in data:
+            user_ids = db_manager.get_cohort_student_ids(**cohort).tolist()
+            if len(user_ids) > API_CONFIG['max_bulk_users']:
+                raise BadRequest(f"Cohort has {len(user_ids)} students, maximum {API_CONFIG['max_bulk_users']} per bulk request")
+        
+        return Response(generate_bulk_rows(model, user_ids, n_recommendations), content_type='application/x-ndjson')
+    
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error in bulk recommendations: {e}")
+        logger.error(traceback.format_exc())
+        raise InternalServerError("Failed to generate bulk recommendations")
+
+def generate_bulk_rows(model: HybridRecommender, user_ids: List[int], n_recommendations: int):
+    """NDJSON lines for the bulk endpoint, one chunk of students at a time.
+    
+    Each chunk takes its own background admission slot and gives it back before its rows
+    are written, so a long stream to a slow client shares scoring capacity with interactive
+    requests instead of holding a slot throughout. Bulk results bypass the response cache, which
+    would otherwise evict the entries interactive traffic relies on.
+    """
+    failed_users = 0
+    chunk_size = MODEL_CONFIG['batch_chunk_size']
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        
+        # Bulk work is not latency sensitive: it waits out saturation behind queued requests instead of being shed
+        admission.acquire_background()
+        try:
+            results = model.get_recommendations_batch(chunk, n_recommendations)
+            rows = [{'user_id': user_id, 'recommendations': results[user_id]} for user_id in chunk]
+        except Exception as e:
+            logger.warning(f"Failed to get bulk recommendations for {len(chunk)} users: {e}")
+            failed_users += len(chunk)
+            rows = [{'user_id': user_id, 'error': 'Failed to generate recommendations'} for user_id in chunk]
+        finally:
+            admission.release()
+        
+        yield ''.join(json.dumps(row) + '\n' for row in rows)
+    
+    yield json.dumps({
+        'done': True,
+        'total_users': len(user_ids),
+        'failed_users': failed_users,
+        'model_version': model.model_version,
+        'timestamp': datetime.now().isoformat()
+    }) + '\n'
+
 @app.route('/user/<int:user_id>/activity', methods=['POST'])
 def log_user_activity(user_id):
-    """Log user activity for incremental learning"""
+    """Queue user activity for incremental learning; it is applied in the background"""
     try:
         data = request.get_json()
         
@@ -365,17 +744,28 @@ def log_user_activity(user_id):
         activity_type = data['activity_type']
         course_id = data.get('course_id')
         
-        # Log activity for incremental learning
-        if incremental_recommender:
-            incremental_recommender.update_with_new_activity(user_id, activity_type, course_id)
+        if not isinstance(activity_type, str):
+            raise BadRequest("activity_type must be a string")
+        if course_id is not None and not isinstance(course_id, int):
+            raise BadRequest("course_id must be an integer")
+        
+        # Return as soon as the event is queued; a full queue pushes back on the client
+        if not activity_ingestor.submit(user_id, activity_type, course_id):
+            response = jsonify({
+                'error': 'Activity queue full',
+                'message': 'Too many activity events, retry shortly',
+                'timestamp': datetime.now().isoformat()
+            })
+            response.headers['Retry-After'] = str(INGESTION_CONFIG['retry_after_seconds'])
+            return response, 503
         
         return jsonify({
-            'message': 'Activity logged successfully',
+            'message': 'Activity queued',
             'user_id': user_id,
             'activity_type': activity_type,
             'course_id': course_id,
             'timestamp': datetime.now().isoformat()
-        })
+        }), 202
     
     except BadRequest as e:
         raise e
@@ -389,11 +779,26 @@ def manual_retrain():
     try:
         logger.info("Manual retrain requested")
         
+        # Under the prefork server only the trainer process trains; hand the request to it
+        if process_role == 'worker':
+            os.makedirs(TRAINING_CONFIG['model_path'], exist_ok=True)
+            with open(retrain_request_path(), 'w') as f:
+                f.write(datetime.now().isoformat())
+            return jsonify({
+                'message': 'Model retraining requested from the training process',
+                'timestamp': datetime.now().isoformat()
+            })
+        
+        if training_lock.locked():
+            return jsonify({
+                'message': 'Model retraining already in progress',
+                'timestamp': datetime.now().isoformat()
+            }), 409
+        
         # Run training in background thread to avoid timeout
         def background_training():
             try:
-                if train_model():
-                    run_evaluation()
+                if train_model(evaluate=True):
                     logger.info("Manual retrain completed successfully")
                 else:
                     logger.error("Manual retrain failed")
@@ -417,16 +822,23 @@ def model_status():
     try:
         model_path = TRAINING_CONFIG['model_path']
         
+        model = recommender
         status_info = {
-            'model_loaded': recommender is not None and recommender.is_trained,
-            'model_file_exists': os.path.exists(model_path),
+            'model_loaded': model is not None and model.is_trained,
+            'training_in_progress': training_lock.locked(),
+            'model_file_exists': HybridRecommender.has_artifact(model_path),
             'timestamp': datetime.now().isoformat()
         }
         
-        if os.path.exists(model_path):
-            stat = os.stat(model_path)
-            status_info['model_last_modified'] = datetime.fromtimestamp(stat.st_mtime).isoformat()
-            status_info['model_size_bytes'] = stat.st_size
+        if HybridRecommender.has_artifact(model_path):
+            artifact = HybridRecommender.artifact_info(model_path)
+            status_info['model_last_modified'] = artifact['created_at']
+            status_info['model_size_bytes'] = artifact['size_bytes']
+            status_info['model_version'] = artifact['model_version']
+            status_info['artifact_format_version'] = artifact['format_version']
+        
+        if model is not None:
+            status_info['loaded_model_version'] = model.model_version
         
         return jsonify(status_info)
     
@@ -468,6 +880,7 @@ def get_latest_evaluation():
 def system_info():
     """Get system information"""
     try:
+        model = recommender
         return jsonify({
             'system': 'Course Recommendation System',
             'version': '1.0.0',
@@ -477,9 +890,15 @@ def system_info():
                 'debug': API_CONFIG['debug']
             },
             'model_config': {
-                'collaborative_weight': recommender.collaborative_weight if recommender else None,
-                'content_weight': recommender.content_weight if recommender else None
+                'collaborative_weight': model.collaborative_weight if model else None,
+                'content_weight': model.content_weight if model else None,
+                'mf_weight': model.mf_weight if model else None
             },
+            'ingestion': activity_ingestor.stats(),
+            'recommendation_cache': recommendation_cache.stats(),
+            'admission': admission.stats(),
+            'database_pool': db_manager.get_pool_stats() if db_manager else None,
+            'training_snapshot': training_snapshot.stats() if training_snapshot else None,
             'uptime': datetime.now().isoformat(),
             'timestamp': datetime.now().isoformat()
         })
@@ -488,6 +907,16 @@ def system_info():
         logger.error(f"Error getting system info: {e}")
         raise InternalServerError("Failed to get system information")
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metrics in the Prometheus text format; under serving.py they cover every worker and the trainer"""
+    try:
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+    
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {e}")
+        raise InternalServerError("Failed to render metrics")
+
 def main():
     """Main function to start the application"""
     try:
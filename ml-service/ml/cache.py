@@ -0,0 +1,120 @@
+"""
+Response cache for the Course Recommendation System
+Keeps recently served recommendation lists in process, bounded by entry count and age
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from config import API_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class RecommendationCache:
+    """LRU cache of recommendation lists with a TTL, keyed by (user_id, n_recommendations, model_version).
+    
+    The model version in the key means a newly published model never serves lists
+    computed by the previous one; clear() on publish just frees their memory. Folding a
+    student's activity into the live model calls invalidate_user, which drops that
+    student's entries and bumps their generation so a list computed before the fold-in
+    is not stored after it.
+    """
+    
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        self.max_entries = max_entries or API_CONFIG['cache_max_entries']
+        self.ttl = ttl_seconds or API_CONFIG['cache_ttl']
+        
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, recommendations), oldest first
+        self._user_keys: Dict[int, set] = {}
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,  # Misses on an entry older than the TTL
+            'evictions': 0,  # Entries dropped to stay under max_entries
+            'invalidations': 0  # Entries dropped because the student's activity changed the model
+        }
+    
+    def generation(self, user_id: int) -> int:
+        """Ticket to pass to put(); taken before computing a student's recommendations"""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+    
+    def get(self, user_id: int, n_recommendations: int, model_version: Hashable) -> Optional[List[Dict]]:
+        """Cached list for the key, or None; callers must not mutate the returned list"""
+        key = (user_id, n_recommendations, model_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            
+            expires_at, recommendations = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.counters['expired'] += 1
+                self.counters['misses'] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return recommendations
+    
+    def put(self, user_id: int, n_recommendations: int, model_version: Hashable,
+            recommendations: List[Dict], generation: int):
+        """Store a list unless the student was invalidated since generation was taken"""
+        key = (user_id, n_recommendations, model_version)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            
+            self._entries[key] = (time.monotonic() + self.ttl, recommendations)
+            self._entries.move_to_end(key)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.counters['evictions'] += 1
+    
+    def invalidate_user(self, user_id: int):
+        """Drop every entry of a student whose activity was just folded into the model"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in self._user_keys.pop(user_id, ()):
+                del self._entries[key]
+                self.counters['invalidations'] += 1
+    
+    def clear(self):
+        """Drop all entries, e.g. after a new model is published"""
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self._generations.clear()
+    
+    def _remove(self, key: Tuple):
+        del self._entries[key]
+        user_keys = self._user_keys.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._user_keys[key[0]]
+    
+    def stats(self) -> Dict:
+        """Size, counters and hit ratio"""
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+        
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            **counters,
+            'hit_ratio': counters['hits'] / lookups if lookups else 0.0
+        }
@@ -13,13 +13,39 @@ DATABASE_CONFIG = {
     'autocommit': True
 }
 
+# Database Connection Pool Configuration
+DATABASE_POOL_CONFIG = {
+    'max_connections': 10,  # Upper bound on open connections shared by all threads
+    'checkout_timeout_seconds': 30,  # Longest a query waits for a free connection
+    'health_check_interval_seconds': 30  # Ping connections idle for longer than this before reuse
+}
+
 # Model Parameters
 MODEL_CONFIG = {
     'collaborative_weight': 0.6,
     'content_weight': 0.4,
+    'mf_weight': 0.0,  # Weight of the ALS matrix factorization scores (0 disables it)
     'min_interactions': 3,  # Minimum interactions for collaborative filtering
     'n_recommendations': 5,  # Number of recommendations to return
+    'batch_chunk_size': 256,  # Users scored together by get_recommendations_batch
     'similarity_threshold': 0.1,  # Minimum similarity for recommendations
+    'collaborative_mode': 'user',  # 'user' (user-user) or 'item' (item-item) collaborative filtering
+    'n_neighbors': 10,  # Top-k similar users kept per student
+    'n_item_neighbors': 20,  # Top-k similar courses kept per course in item mode
+    'similarity_block_size': 256,  # Rows per block when computing neighbors
+    'neighbor_backend': 'exact',  # 'exact' or 'lsh' (approximate, random-hyperplane LSH)
+    # LSH trades recall for time, and only wins on large cohorts: exact search grows with students^2, LSH with
+    # students * lsh_tables * lsh_max_bucket_size. Measured with the defaults against exact search (k=10):
+    # 20k students 2.3x slower, recall 0.91; 50k as fast, recall 0.77; 100k 1.8x faster, recall 0.67, with the
+    # neighbors found 97% as similar as the exact ones. Bigger buckets raise recall and cost (100k, 1024: recall 0.81, as slow as exact)
+    'lsh_min_users': 100000,  # Below this many students the lsh backend uses exact search
+    'lsh_tables': 32,  # Number of independent hash tables; recall and time grow with it
+    'lsh_max_bucket_size': 512,  # Hash bits per bucket are added until it holds at most this many students
+    'ann_recall_sample_size': 500,  # Users sampled to measure ANN recall against exact search
+    'als_factors': 32,  # Latent factors per student / course
+    'als_iterations': 10,
+    'als_regularization': 0.1,
+    'als_alpha': 10.0,  # Confidence = 1 + alpha * interaction score
     'random_state': 42
 }
 
@@ -44,13 +70,24 @@ FEATURE_CONFIG = {
 
 # Training Configuration
 TRAINING_CONFIG = {
-    'model_path': 'ml/model.pkl',
-    'backup_model_path': 'ml/model_backup.pkl',
+    'model_path': 'ml/model',  # Artifact directory: one subdirectory per version plus a CURRENT pointer
+    'legacy_model_path': 'ml/model.pkl',  # Pickled model from older releases, read once and converted
+    'artifact_keep_versions': 2,  # Versions kept on disk; the previous one doubles as the backup
+    'materialize_recommendations': True,  # Precompute top-N for every known student after training
+    'query_chunk_rows': 50000,  # Rows per chunk when streaming training queries
     'retrain_threshold_days': 7,  # Retrain if model is older than this
     'min_training_samples': 10,  # Minimum samples needed for training
     'cross_validation_folds': 3
 }
 
+# Training Snapshot Configuration
+SNAPSHOT_CONFIG = {
+    'enabled': True,  # Train from a local columnar copy of the training tables instead of full queries
+    'path': 'ml/snapshot',  # One subdirectory of .npy columns per table
+    'full_reload_hours': 168,  # Periodic full reload picks up deletes and edits that move no watermark and are not refreshed every sync
+    'watermark_overlap_minutes': 5  # Delta fetches re-read this far behind the watermark to catch late commits
+}
+
 # Evaluation Configuration
 EVALUATION_CONFIG = {
     'test_size': 0.2,
@@ -65,7 +102,27 @@ API_CONFIG = {
     'port': 8000,
     'debug': False,
     'cache_ttl': 3600,  # Cache recommendations for 1 hour
-    'max_concurrent_requests': 100
+    'cache_max_entries': 50000,  # Cached recommendation lists kept before least recently used ones are evicted
+    'max_concurrent_requests': 100,  # Recommendation requests scored at once
+    'admission_queue_size': 50,  # Requests allowed to wait for a scoring slot; beyond this they are shed
+    'admission_queue_timeout_seconds': 0.25,  # Longest a request waits for a slot
+    'admission_retry_after_seconds': 1,  # Retry-After sent with 503 when shedding
+    'degrade_when_saturated': True,  # Shed requests get cached or popular courses instead of a 503
+    'max_batch_users': 5000,  # Maximum user_ids per POST /recommendations
+    'max_bulk_users': 200000  # Maximum students per POST /recommendations/bulk, listed or resolved from a cohort
+}
+
+# Prefork Serving Configuration
+SERVING_CONFIG = {
+    'workers': 4,  # API worker processes; all memory-map the same model artifact
+    'threads_per_worker': 4,  # Request threads per worker; max_concurrent_requests applies per worker
+    'worker_timeout_seconds': 60,  # Workers silent for longer than this are restarted
+    'worker_init_retry_seconds': 10,  # A worker that fails to initialize waits this long before exiting to be respawned
+    'trainer_poll_seconds': 5,  # How often the master checks the training process, and its first restart delay
+    'trainer_restart_max_seconds': 300,  # Restart delay cap; it doubles while the trainer keeps crashing
+    'artifact_poll_seconds': 10,  # How often workers check for a newly published model, and the trainer for retrain requests
+    'metrics_dir': 'ml/metrics',  # Per-process metric files; /metrics on any worker merges all of them
+    'metrics_flush_seconds': 5  # How stale another process's samples can be in a scrape
 }
 
 # Logging Configuration
@@ -79,7 +136,26 @@ LOGGING_CONFIG = {
 
 # Data Refresh Configuration
 REFRESH_CONFIG = {
-    'incremental_update_minutes': 30,  # Update incremental data every 30 minutes
+    'incremental_update_minutes': 30,  # Sync the training snapshot with new rows every 30 minutes
     'full_retrain_hours': 24,  # Full retrain every 24 hours
-    'cleanup_old_activities_days': 365  # Keep activities for 1 year
-}
\ No newline at end of file
+    'replay_buffer_size': 10000,  # Recent folded-in events replayed onto a freshly retrained model
+    'cleanup_old_activities_days': 365,  # Keep activities for 1 year
+    # Activity types that imply an enrollment, with the completion status they stand for
+    'activity_completion_status': {
+        'enrollment': 'not_started',
+        'course_access': 'in_progress',
+        'module_complete': 'in_progress',
+        'assignment_submit': 'in_progress',
+        'quiz_complete': 'in_progress',
+        'course_complete': 'completed'
+    }
+}
+
+# Activity Ingestion Configuration
+INGESTION_CONFIG = {
+    'queue_size': 10000,  # Events buffered before POST /user/<id>/activity answers 503
+    'batch_size': 500,  # Events coalesced and applied together
+    'flush_interval_seconds': 0.5,  # Longest an event waits for its batch to fill
+    'retry_after_seconds': 1,  # Retry-After sent to clients when the queue is full
+    'shared_log_dir': 'ml/activity_log'  # Hourly activity segments that serving.py workers append to and tail
+}
@@ -7,18 +7,25 @@ import os
 import pymysql
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import StandardScaler, normalize
 from datetime import datetime, timedelta
+import json
 import pickle
+import shutil
 import logging
-from typing import List, Dict, Tuple, Optional
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Iterator, Callable
 import warnings
 from logging.handlers import RotatingFileHandler
 warnings.filterwarnings('ignore')
 
-from config import DATABASE_CONFIG, MODEL_CONFIG, FEATURE_CONFIG, LOGGING_CONFIG
+from config import DATABASE_CONFIG, DATABASE_POOL_CONFIG, MODEL_CONFIG, FEATURE_CONFIG, LOGGING_CONFIG, REFRESH_CONFIG, TRAINING_CONFIG
+from metrics import DB_QUERY_SECONDS, RECOMMENDATION_STAGE_SECONDS, TRAINING_SECONDS
 
 # Setup logging
 logger = logging.getLogger()
@@ -36,38 +43,409 @@ handler.setFormatter(formatter)
 if not logger.handlers:
     logger.addHandler(handler)
 
+def top_k_cosine_neighbors(matrix: sparse.csr_matrix, k: int, block_size: int = 256,
+                           rows: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the exact top-k cosine neighbors of each row (or of `rows`), one block at a time"""
+    n_rows = matrix.shape[0]
+    rows = np.arange(n_rows) if rows is None else np.asarray(rows)
+    k = max(0, min(k, n_rows - 1))
+    indices = np.zeros((len(rows), k), dtype=np.int32)
+    similarities = np.zeros((len(rows), k), dtype=np.float32)
+    
+    if k == 0:
+        return indices, similarities
+    
+    normalized = normalize(matrix.astype(np.float32), norm='l2', axis=1).tocsr()
+    normalized_t = normalized.T.tocsr()
+    
+    # Only a block_size x n_rows slice of the similarity matrix is ever dense
+    for start in range(0, len(rows), block_size):
+        end = min(start + block_size, len(rows))
+        block_rows = rows[start:end]
+        block = (normalized[block_rows] @ normalized_t).toarray()
+        block[np.arange(end - start), block_rows] = -np.inf  # Exclude self
+        
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind='stable')
+        
+        indices[start:end] = np.take_along_axis(top, order, axis=1)
+        similarities[start:end] = np.take_along_axis(top_similarities, order, axis=1)
+    
+    return indices, similarities
+
+def lsh_buckets(normalized: sparse.csr_matrix, rng: np.random.Generator, max_bucket_size: int,
+                max_bits: int = 32) -> np.ndarray:
+    """Bucket of every row for one random-hyperplane hash table, numbered 0..n_buckets-1.
+    
+    A row's bucket is the shortest prefix of its hash code that at most max_bucket_size
+    rows share, so the number of bits follows the row count and local density instead of
+    being fixed, and oversized buckets are split by further hyperplanes rather than at
+    random. Rows that share their whole code (near-identical rows) are cut into groups.
+    """
+    n_rows = normalized.shape[0]
+    hyperplanes = rng.standard_normal((normalized.shape[1], max_bits)).astype(np.float32)
+    bits = np.asarray(normalized @ hyperplanes) > 0
+    
+    buckets = np.full(n_rows, -1, dtype=np.int64)
+    codes = np.zeros(n_rows, dtype=np.int64)
+    active = np.arange(n_rows)
+    next_bucket = 0
+    for bit in range(max_bits):
+        codes[active] = codes[active] * 2 + bits[active, bit]
+        _, inverse, counts = np.unique(codes[active], return_inverse=True, return_counts=True)
+        fits = counts[inverse] <= max_bucket_size
+        buckets[active[fits]] = next_bucket + inverse[fits]
+        next_bucket += len(counts)
+        active = active[~fits]
+        if active.size == 0:
+            break
+    
+    if active.size:
+        _, inverse = np.unique(codes[active], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        rank = np.arange(active.size) - np.searchsorted(inverse[order], inverse[order])
+        groups_per_code = active.size // max_bucket_size + 1
+        buckets[active[order]] = next_bucket + inverse[order] * groups_per_code + rank // max_bucket_size
+    
+    return np.unique(buckets, return_inverse=True)[1]
+
+def top_k_pairs(rows: np.ndarray, cols: np.ndarray, similarities: np.ndarray,
+                k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keep the k most similar (row, col) pairs of every row, sorted by row then descending similarity"""
+    # Cosines lie in [-1, 1], so row + (1 - similarity) / 4 orders by row first with a single sort
+    order = np.argsort(rows + (1.0 - similarities.astype(np.float64)) / 4.0, kind='stable')
+    rows, cols, similarities = rows[order], cols[order], similarities[order]
+    rank = np.arange(rows.size) - np.searchsorted(rows, rows)
+    keep = rank < k
+    return rows[keep], cols[keep], similarities[keep]
+
+def lsh_cosine_neighbors(matrix: sparse.csr_matrix, k: int, n_tables: int = 32, max_bucket_size: int = 512,
+                         random_state: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Approximate top-k cosine neighbors using random-hyperplane LSH.
+    
+    Rows are only compared with rows that share a hash bucket in at least one
+    table, so cost grows with n_rows * n_tables * max_bucket_size rather than
+    with n_rows^2. Missing neighbors are padded with index -1 and similarity 0.
+    """
+    n_rows, n_cols = matrix.shape
+    k = max(0, min(k, n_rows - 1))
+    indices = np.full((n_rows, k), -1, dtype=np.int32)
+    similarities = np.zeros((n_rows, k), dtype=np.float32)
+    
+    if k == 0:
+        return indices, similarities
+    
+    normalized = normalize(matrix.astype(np.float32), norm='l2', axis=1).tocsr()
+    rng = np.random.default_rng(random_state)
+    entry_rows = np.repeat(np.arange(n_rows), np.diff(normalized.indptr))
+    
+    # Running candidate list, reduced to at most k entries per row after every table
+    cand_rows = np.empty(0, dtype=np.int64)
+    cand_cols = np.empty(0, dtype=np.int64)
+    cand_sims = np.empty(0, dtype=np.float32)
+    
+    for _ in range(n_tables):
+        buckets = lsh_buckets(normalized, rng, max_bucket_size)
+        
+        # Every bucket gets its own copy of the columns, so one sparse product scores
+        # exactly the pairs of rows that share a bucket (and at least one course)
+        shifted = sparse.csr_matrix(
+            (normalized.data, buckets[entry_rows] * n_cols + normalized.indices, normalized.indptr),
+            shape=(n_rows, (int(buckets.max()) + 1) * n_cols)
+        )
+        pairs = (shifted @ shifted.T).tocsr()
+        rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(pairs.indptr))
+        cols = pairs.indices.astype(np.int64)
+        other = rows != cols
+        table_rows, table_cols, table_sims = top_k_pairs(rows[other], cols[other], pairs.data[other], k)
+        
+        # Drop pairs seen in earlier tables, then keep the k best per row
+        rows = np.concatenate([cand_rows, table_rows])
+        cols = np.concatenate([cand_cols, table_cols])
+        sims = np.concatenate([cand_sims, table_sims.astype(np.float32)])
+        _, first = np.unique(rows * n_rows + cols, return_index=True)
+        cand_rows, cand_cols, cand_sims = top_k_pairs(rows[first], cols[first], sims[first], k)
+    
+    rank = np.arange(cand_rows.size) - np.searchsorted(cand_rows, cand_rows)
+    indices[cand_rows, rank] = cand_cols
+    similarities[cand_rows, rank] = cand_sims
+    return indices, similarities
+
+def top_n_indices(scores: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the n highest finite scores, best first (ties broken by index)"""
+    top = top_n_per_row(scores[None, :], n)[0]
+    return top[np.isfinite(scores[top])]
+
+def top_n_per_row(scores: np.ndarray, n: int) -> np.ndarray:
+    """Column indices of the n highest scores in every row, best first (ties broken by index).
+    
+    Rows with fewer than n finite scores are padded with -inf columns; callers filter on np.isfinite.
+    """
+    n_rows, n_cols = scores.shape
+    n = max(0, min(n, n_cols))
+    if n == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    
+    # Everything above each row's n-th best score, plus the lowest-index ties with it
+    kth = -np.partition(-scores, n - 1, axis=1)[:, n - 1:n]
+    above = scores > kth
+    ties = scores == kth
+    needed = n - above.sum(axis=1, keepdims=True)
+    selected = above | (ties & (np.cumsum(ties, axis=1) <= needed))
+    
+    top = np.nonzero(selected)[1].reshape(n_rows, n)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+# Bump whenever the artifact layout changes in a way older readers cannot handle
+ARTIFACT_FORMAT_VERSION = 1
+
+def csr_arrays(matrix: Optional[sparse.csr_matrix], prefix: str) -> Dict[str, np.ndarray]:
+    """The data/indices/indptr arrays of a CSR (or CSC) matrix, keyed for an artifact"""
+    if matrix is None:
+        return {}
+    return {f"{prefix}.data": matrix.data, f"{prefix}.indices": matrix.indices, f"{prefix}.indptr": matrix.indptr}
+
+def csr_from_arrays(arrays: Dict[str, np.ndarray], prefix: str, shape) -> Optional[sparse.csr_matrix]:
+    """Wrap saved (possibly memory-mapped) CSR arrays in a matrix without copying them"""
+    if shape is None:
+        return None
+    return sparse.csr_matrix(
+        (arrays[f"{prefix}.data"], arrays[f"{prefix}.indices"], arrays[f"{prefix}.indptr"]),
+        shape=tuple(shape), copy=False
+    )
+
+def csc_from_arrays(arrays: Dict[str, np.ndarray], prefix: str, shape) -> Optional[sparse.csc_matrix]:
+    """Wrap saved (possibly memory-mapped) CSC arrays in a matrix without copying them"""
+    if shape is None or f"{prefix}.data" not in arrays:
+        return None
+    return sparse.csc_matrix(
+        (arrays[f"{prefix}.data"], arrays[f"{prefix}.indices"], arrays[f"{prefix}.indptr"]),
+        shape=tuple(shape), copy=False
+    )
+
 class DatabaseManager:
-    """Handles all database operations for the recommendation system"""
+    """Handles all database operations for the recommendation system.
+    
+    Connections come from a bounded pool. A thread checks one out for the duration of a
+    query (nested checkouts on the same thread reuse it), so request threads, the
+    scheduler and background training can query MySQL in parallel.
+    """
     
     def __init__(self):
-        self.connection = None
-        self.connect()
+        self.max_connections = DATABASE_POOL_CONFIG['max_connections']
+        self.checkout_timeout = DATABASE_POOL_CONFIG['checkout_timeout_seconds']
+        self.health_check_interval = DATABASE_POOL_CONFIG['health_check_interval_seconds']
+        
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._idle = deque()  # (connection, last returned at) of connections not checked out
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()  # Connection this thread has checked out, and nesting depth
+        self._closed = False
+        
+        self._stats_lock = threading.Lock()
+        self.pool_stats = {
+            'checkouts': 0,
+            'waits': 0,  # Checkouts that found every connection in use
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0  # Failed a health check or broke while in use
+        }
+        
+        # Fail fast on bad configuration, and keep the connection for the first query
+        self._idle.append((self.connect(), time.monotonic()))
     
     def connect(self):
-        """Establish database connection"""
+        """Open a new database connection"""
         try:
-            self.connection = pymysql.connect(**DATABASE_CONFIG)
+            connection = pymysql.connect(**DATABASE_CONFIG)
+            self._count('connections_created')
             logger.info("Database connection established")
+            return connection
         except Exception as e:
             logger.error(f"Database connection failed: {e}")
             raise
     
-    def ensure_connection(self):
-        """Ensure database connection is active"""
+    def _count(self, name: str, amount=1):
+        with self._stats_lock:
+            self.pool_stats[name] += amount
+    
+    @contextmanager
+    def checkout(self, exclusive: bool = False):
+        """Borrow a pooled connection for this thread, returning it to the pool afterwards.
+        
+        An exclusive checkout is never shared with nested checkouts on the same thread, so
+        queries issued while a streaming cursor is open get a connection of their own.
+        """
+        if exclusive:
+            connection = self._acquire()
+            broken = False
+            try:
+                yield connection
+            except Exception as e:
+                broken = self._is_connection_error(e)
+                raise
+            finally:
+                self._release(connection, broken)
+            return
+        
+        local = self._local
+        if getattr(local, 'connection', None) is not None:
+            local.depth += 1
+            try:
+                yield local.connection
+            finally:
+                local.depth -= 1
+            return
+        
+        connection = self._acquire()
+        local.connection, local.depth = connection, 1
+        broken = False
+        try:
+            yield connection
+        except Exception as e:
+            broken = self._is_connection_error(e)
+            raise
+        finally:
+            local.connection = None
+            self._release(connection, broken)
+    
+    @staticmethod
+    def _is_connection_error(error: Exception) -> bool:
+        """Whether a query failed because the connection broke; pandas re-raises driver errors as its own DatabaseError"""
+        if isinstance(error, pd.errors.DatabaseError):
+            error = error.__cause__
+        return isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+    
+    def _acquire(self):
+        """Take a pool slot, waiting up to checkout_timeout, then an idle or new connection"""
+        if not self._slots.acquire(blocking=False):
+            start = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.checkout_timeout)
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self.pool_stats['waits'] += 1
+                self.pool_stats['wait_seconds_total'] += waited
+                self.pool_stats['wait_seconds_max'] = max(self.pool_stats['wait_seconds_max'], waited)
+            if not acquired:
+                self._count('timeouts')
+                raise TimeoutError(f"No database connection available after {self.checkout_timeout}s")
+        
+        try:
+            self._count('checkouts')
+            while True:
+                with self._idle_lock:
+                    connection, returned_at = self._idle.pop() if self._idle else (None, None)
+                if connection is None:
+                    return self.connect()
+                
+                # Connections idle for a while may have been dropped by the server
+                if time.monotonic() - returned_at < self.health_check_interval:
+                    return connection
+                try:
+                    connection.ping(reconnect=True)
+                    return connection
+                except Exception:
+                    self._discard(connection)
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def _release(self, connection, broken: bool = False):
+        """Return a connection to the pool, or close it if it broke or the pool is closed"""
         try:
-            self.connection.ping(reconnect=True)
-        except:
-            self.connect()
+            # pymysql closes its socket when the server goes away mid-query, whatever error reaches us
+            if broken or self._closed or not connection.open:
+                self._discard(connection)
+            else:
+                with self._idle_lock:
+                    self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+    
+    def _discard(self, connection):
+        self._count('connections_discarded')
+        try:
+            connection.close()
+        except Exception:
+            pass
+    
+    def ensure_connection(self):
+        """Ensure the database is reachable through a pooled connection"""
+        with self.checkout() as connection:
+            connection.ping(reconnect=True)
     
     def execute_query(self, query: str, params: tuple = None) -> pd.DataFrame:
         """Execute query and return results as DataFrame"""
-        self.ensure_connection()
         try:
-            return pd.read_sql(query, self.connection, params=params)
+            with self.checkout() as connection, DB_QUERY_SECONDS.time(kind='query'):
+                return pd.read_sql(query, connection, params=params)
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
             raise
     
+    def execute_query_chunks(self, query: str, params: tuple = None, dtypes: Dict[str, str] = None,
+                             chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream a query through a server-side cursor, yielding DataFrames of at most chunk_size rows.
+        
+        Rows are never all held client-side. dtypes casts columns in each chunk ('bool' fills NULL
+        with False, 'datetime64[ns]' parses timestamps), so every chunk has the same column types.
+        The connection stays checked out until the generator is exhausted or closed.
+        """
+        chunk_size = chunk_size or TRAINING_CONFIG['query_chunk_rows']
+        try:
+            with self.checkout(exclusive=True) as connection:
+                cursor = connection.cursor(pymysql.cursors.SSCursor)
+                # Time spent in the database only, not in whoever consumes the chunks
+                database_seconds = 0.0
+                try:
+                    start = time.perf_counter()
+                    cursor.execute(query, params)
+                    database_seconds += time.perf_counter() - start
+                    columns = [column[0] for column in cursor.description]
+                    while True:
+                        start = time.perf_counter()
+                        rows = cursor.fetchmany(chunk_size)
+                        database_seconds += time.perf_counter() - start
+                        if not rows:
+                            break
+                        yield self._typed_chunk(pd.DataFrame.from_records(rows, columns=columns), dtypes)
+                finally:
+                    cursor.close()
+                    DB_QUERY_SECONDS.observe(database_seconds, kind='stream')
+        except Exception as e:
+            logger.error(f"Streaming query failed: {e}")
+            raise
+    
+    @staticmethod
+    def _typed_chunk(chunk: pd.DataFrame, dtypes: Optional[Dict[str, str]]) -> pd.DataFrame:
+        """Cast a chunk's columns to the requested dtypes"""
+        for column, dtype in (dtypes or {}).items():
+            if column not in chunk:
+                continue
+            if dtype == 'bool':
+                chunk[column] = chunk[column].fillna(False).astype(bool)
+            elif dtype.startswith('datetime64'):
+                chunk[column] = pd.to_datetime(chunk[column])
+            else:
+                chunk[column] = chunk[column].astype(dtype)
+        return chunk
+    
+    def get_pool_stats(self) -> Dict:
+        """Pool size, idle connections and checkout wait metrics"""
+        with self._stats_lock:
+            stats = dict(self.pool_stats)
+        with self._idle_lock:
+            idle = len(self._idle)
+        
+        stats['max_connections'] = self.max_connections
+        stats['idle_connections'] = idle
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+    
     def get_user_activities(self, days_back: int = 90) -> pd.DataFrame:
         """Get user activities for engagement scoring"""
         cutoff_date = datetime.now() - timedelta(days=days_back)
@@ -79,6 +457,33 @@ class DatabaseManager:
         """
         return self.execute_query(query, (cutoff_date,))
     
+    def iter_activity_days(self, days_back: int = 90, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream activity counts per student, type and day over the last days_back whole days, in chunks"""
+        cutoff_date = datetime.combine((datetime.now() - timedelta(days=days_back)).date(), datetime.min.time())
+        query = """
+        SELECT user_id, type, DATE(created_at) as day, COUNT(*) as events
+        FROM user_activities 
+        WHERE created_at >= %s
+        GROUP BY user_id, type, DATE(created_at)
+        """
+        dtypes = {'user_id': 'int64', 'type': 'object', 'day': 'datetime64[ns]', 'events': 'int64'}
+        return self.execute_query_chunks(query, (cutoff_date,), dtypes, chunk_size)
+    
+    def iter_interactions(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream (student, course, status, progress) rows of published courses, in chunks"""
+        query = """
+        SELECT 
+            e.student_id,
+            e.course_id,
+            e.completion_status,
+            e.progress
+        FROM enrollments e
+        JOIN courses c ON e.course_id = c.id
+        WHERE c.status = 'published'
+        """
+        dtypes = {'student_id': 'int64', 'course_id': 'int64', 'completion_status': 'object', 'progress': 'float64'}
+        return self.execute_query_chunks(query, dtypes=dtypes, chunk_size=chunk_size)
+    
     def get_enrollments_data(self) -> pd.DataFrame:
         """Get enrollment data with course information"""
         query = """
@@ -118,6 +523,21 @@ class DatabaseManager:
         """
         return self.execute_query(query)
     
+    def iter_quiz_attempts(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream finished quiz attempts, in chunks"""
+        query = """
+        SELECT 
+            qa.student_id,
+            q.course_id,
+            qa.score,
+            qa.is_passing
+        FROM quiz_attempts qa
+        JOIN quizzes q ON qa.quiz_id = q.id
+        WHERE qa.end_time IS NOT NULL
+        """
+        dtypes = {'student_id': 'int64', 'course_id': 'int64', 'score': 'float64', 'is_passing': 'bool'}
+        return self.execute_query_chunks(query, dtypes=dtypes, chunk_size=chunk_size)
+    
     def get_assignment_submissions(self) -> pd.DataFrame:
         """Get assignment submission data"""
         query = """
@@ -133,6 +553,21 @@ class DatabaseManager:
         """
         return self.execute_query(query)
     
+    def iter_assignment_submissions(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream graded assignment submissions, in chunks"""
+        query = """
+        SELECT 
+            asub.student_id,
+            a.course_id,
+            asub.grade,
+            asub.is_late
+        FROM assignment_submissions asub
+        JOIN assignments a ON asub.assignment_id = a.id
+        WHERE asub.grade IS NOT NULL
+        """
+        dtypes = {'student_id': 'int64', 'course_id': 'int64', 'grade': 'float64', 'is_late': 'bool'}
+        return self.execute_query_chunks(query, dtypes=dtypes, chunk_size=chunk_size)
+    
     def get_course_features(self) -> pd.DataFrame:
         """Get course features for content-based filtering"""
         query = """
@@ -168,11 +603,34 @@ class DatabaseManager:
         """
         return self.execute_query(query)
     
+    def get_cohort_student_ids(self, department_id: int = None, course_id: int = None) -> np.ndarray:
+        """Ids of students enrolled in a published course of the department and/or in the course, ascending"""
+        conditions = ["c.status = 'published'"]
+        params = []
+        if department_id is not None:
+            conditions.append("c.department_id = %s")
+            params.append(department_id)
+        if course_id is not None:
+            conditions.append("e.course_id = %s")
+            params.append(course_id)
+        
+        query = f"""
+        SELECT DISTINCT e.student_id
+        FROM enrollments e
+        JOIN courses c ON e.course_id = c.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY e.student_id
+        """
+        return self.execute_query(query, tuple(params))['student_id'].to_numpy(dtype=np.int64)
+    
     def close(self):
-        """Close database connection"""
-        if self.connection:
-            self.connection.close()
-            logger.info("Database connection closed")
+        """Close idle connections; connections still checked out close when returned"""
+        self._closed = True
+        with self._idle_lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            connection.close()
+        logger.info("Database connections closed")
 
 class FeatureEngineer:
     """Handles feature engineering for recommendations"""
@@ -181,53 +639,43 @@ class FeatureEngineer:
         self.db = db_manager
         self.engagement_weights = FEATURE_CONFIG['engagement_weights']
         self.time_decay = FEATURE_CONFIG['time_decay_factor']
+        self.max_days_lookback = FEATURE_CONFIG['max_days_lookback']
     
     def calculate_engagement_scores(self) -> pd.DataFrame:
-        """Calculate engagement scores for students"""
-        # Get activities
-        activities = self.db.get_user_activities()
-        quiz_attempts = self.db.get_quiz_attempts()
-        assignments = self.db.get_assignment_submissions()
-        
+        """Calculate engagement scores for students, aggregating streamed rows chunk by chunk"""
+        today = pd.Timestamp(datetime.now().date())
         engagement_scores = []
         
-        # Process activities
-        if not activities.empty:
-            activities['days_ago'] = (datetime.now() - pd.to_datetime(activities['created_at'])).dt.days
-            activities['weight'] = activities['type'].map(self.engagement_weights).fillna(1.0)
-            activities['time_weight'] = self.time_decay ** activities['days_ago']
-            activities['engagement_score'] = activities['weight'] * activities['time_weight']
-            
-            activity_scores = activities.groupby('user_id')['engagement_score'].sum().reset_index()
-            activity_scores.columns = ['student_id', 'activity_engagement']
-            engagement_scores.append(activity_scores)
-        
-        # Process quiz attempts
-        if not quiz_attempts.empty:
-            quiz_attempts['quiz_score'] = quiz_attempts['score'] / 100.0  # Normalize to 0-1
-            quiz_attempts['bonus'] = quiz_attempts['is_passing'].astype(float) * 0.5
-            quiz_attempts['total_score'] = quiz_attempts['quiz_score'] + quiz_attempts['bonus']
-            
-            quiz_engagement = quiz_attempts.groupby('student_id').agg({
-                'total_score': 'mean',
-                'course_id': 'count'
-            }).reset_index()
-            quiz_engagement.columns = ['student_id', 'avg_quiz_score', 'quiz_count']
-            quiz_engagement['quiz_engagement'] = quiz_engagement['avg_quiz_score'] * np.log1p(quiz_engagement['quiz_count'])
+        # Process activities: type-weighted event counts per day, decayed by the age of the day bucket
+        activity_totals = None
+        for buckets in self.db.iter_activity_days(self.max_days_lookback):
+            days_ago = (today - buckets['day']).dt.days
+            weight = buckets['type'].map(self.engagement_weights).fillna(1.0)
+            partial = (buckets['events'] * weight * self.time_decay ** days_ago).groupby(buckets['user_id']).sum()
+            activity_totals = partial if activity_totals is None else activity_totals.add(partial, fill_value=0)
+        
+        if activity_totals is not None:
+            engagement_scores.append(pd.DataFrame({
+                'student_id': activity_totals.index,
+                'activity_engagement': activity_totals.values
+            }))
+        
+        # Process quiz attempts: normalized score plus a passing bonus
+        quiz_engagement = self._mean_and_count(
+            self.db.iter_quiz_attempts(),
+            lambda quiz_attempts: quiz_attempts['score'] / 100.0 + quiz_attempts['is_passing'].astype(float) * 0.5
+        )
+        if quiz_engagement is not None:
+            quiz_engagement['quiz_engagement'] = quiz_engagement['mean'] * np.log1p(quiz_engagement['count'])
             engagement_scores.append(quiz_engagement[['student_id', 'quiz_engagement']])
         
-        # Process assignments
-        if not assignments.empty:
-            assignments['assignment_score'] = assignments['grade'] / 100.0
-            assignments['timeliness_bonus'] = (~assignments['is_late']).astype(float) * 0.2
-            assignments['total_score'] = assignments['assignment_score'] + assignments['timeliness_bonus']
-            
-            assignment_engagement = assignments.groupby('student_id').agg({
-                'total_score': 'mean',
-                'course_id': 'count'
-            }).reset_index()
-            assignment_engagement.columns = ['student_id', 'avg_assignment_score', 'assignment_count']
-            assignment_engagement['assignment_engagement'] = assignment_engagement['avg_assignment_score'] * np.log1p(assignment_engagement['assignment_count'])
+        # Process assignments: normalized grade plus a timeliness bonus
+        assignment_engagement = self._mean_and_count(
+            self.db.iter_assignment_submissions(),
+            lambda assignments: assignments['grade'] / 100.0 + (~assignments['is_late']).astype(float) * 0.2
+        )
+        if assignment_engagement is not None:
+            assignment_engagement['assignment_engagement'] = assignment_engagement['mean'] * np.log1p(assignment_engagement['count'])
             engagement_scores.append(assignment_engagement[['student_id', 'assignment_engagement']])
         
         # Combine all engagement scores
@@ -246,6 +694,27 @@ class FeatureEngineer:
             # Return empty DataFrame with correct structure
             return pd.DataFrame(columns=['student_id', 'total_engagement'])
     
+    @staticmethod
+    def _mean_and_count(chunks: Iterator[pd.DataFrame], score) -> Optional[pd.DataFrame]:
+        """Per-student mean of score(chunk) and row count, accumulated over streamed chunks"""
+        totals = None
+        for chunk in chunks:
+            values = score(chunk)
+            partial = pd.DataFrame({
+                'total': values.fillna(0),
+                'scored': values.notna().astype(np.int64),
+                'count': chunk['course_id'].notna().astype(np.int64)
+            }).groupby(chunk['student_id']).sum()
+            totals = partial if totals is None else totals.add(partial, fill_value=0)
+        
+        if totals is None:
+            return None
+        return pd.DataFrame({
+            'student_id': totals.index,
+            'mean': (totals['total'] / totals['scored']).values,
+            'count': totals['count'].values
+        })
+    
     def calculate_course_attractiveness(self) -> pd.DataFrame:
         """Calculate course attractiveness scores"""
         course_features = self.db.get_course_features()
@@ -280,97 +749,552 @@ class FeatureEngineer:
 class CollaborativeFilter:
     """Implements collaborative filtering for course recommendations"""
     
+    # Interaction strength of each enrollment completion status; progress adds up to 1 on top
+    INTERACTION_SCORES = {
+        'not_started': 1.0,
+        'in_progress': 2.0,
+        'completed': 3.0
+    }
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
-        self.user_item_matrix = None
-        self.user_similarity = None
+        self.user_item_matrix = None  # CSR matrix, rows = students, columns = courses
+        self.user_ids = None  # row index -> student_id
+        self.course_ids = None  # column index -> course_id
+        self.user_index = {}  # student_id -> row index
+        self.course_index = {}  # course_id -> column index
+        self.mode = MODEL_CONFIG['collaborative_mode']  # 'user' or 'item'
+        self.neighbor_indices = None  # (n_users, k) int32 row indices of most similar users
+        self.neighbor_similarities = None  # (n_users, k) float32 cosine similarities
+        self.neighbor_backend = None  # 'exact' or 'lsh': the search that built neighbor_indices
+        self.item_neighbor_indices = None  # (n_courses, k) int32 column indices of most similar courses
+        self.item_neighbor_similarities = None  # (n_courses, k) float32 cosine similarities
+        self._item_neighbor_cache = None  # (item_neighbor_indices, sparse neighbor matrix built from them, its absolute values)
+        self._column_cache = None  # (user_item_matrix, CSC copy, row norms) used to fold in new neighbors
+        self.folded_users = {}  # student_id -> (1 x n_courses CSR row, neighbor rows, similarities) since training
     
-    def build_user_item_matrix(self) -> pd.DataFrame:
-        """Build user-item interaction matrix"""
-        enrollments = self.db.get_enrollments_data()
+    def build_user_item_matrix(self) -> sparse.csr_matrix:
+        """Build sparse user-item interaction matrix from streamed enrollment chunks"""
+        # Per-chunk (student, course) score sums and counts; memory is bounded by distinct pairs
+        partials = []
+        for chunk in self.db.iter_interactions():
+            # Interaction scores from completion status plus a progress bonus
+            scores = chunk['completion_status'].map(self.INTERACTION_SCORES) + chunk['progress'].fillna(0) / 100.0
+            chunk = chunk.assign(interaction_score=scores).dropna(subset=['interaction_score'])
+            partials.append(chunk.groupby(['student_id', 'course_id'])['interaction_score'].agg(['sum', 'count']))
+            if len(partials) >= 16:
+                partials = [pd.concat(partials).groupby(level=[0, 1]).sum()]
         
-        if enrollments.empty:
-            return pd.DataFrame()
-        
-        # Create interaction scores based on completion status
-        interaction_scores = {
-            'not_started': 1.0,
-            'in_progress': 2.0,
-            'completed': 3.0
-        }
+        if not partials:
+            return sparse.csr_matrix((0, 0), dtype=np.float32)
         
-        enrollments['interaction_score'] = enrollments['completion_status'].map(interaction_scores)
+        # Average duplicate (student, course) rows like pivot_table did
+        totals = pd.concat(partials).groupby(level=[0, 1]).sum() if len(partials) > 1 else partials[0]
+        interactions = (totals['sum'] / totals['count']).rename('interaction_score').reset_index()
         
-        # Add progress bonus
-        enrollments['progress'] = enrollments['progress'].fillna(0)
-        enrollments['interaction_score'] += enrollments['progress'] / 100.0
+        # Contiguous integer ids for rows and columns
+        self.user_ids, rows = np.unique(interactions['student_id'].values, return_inverse=True)
+        self.course_ids, cols = np.unique(interactions['course_id'].values, return_inverse=True)
+        self.user_index = {int(user_id): i for i, user_id in enumerate(self.user_ids)}
+        self.course_index = {int(course_id): j for j, course_id in enumerate(self.course_ids)}
         
-        # Create user-item matrix
-        user_item_matrix = enrollments.pivot_table(
-            index='student_id',
-            columns='course_id',
-            values='interaction_score',
-            fill_value=0
+        user_item_matrix = sparse.csr_matrix(
+            (interactions['interaction_score'].values.astype(np.float32), (rows, cols)),
+            shape=(len(self.user_ids), len(self.course_ids))
         )
         
         self.user_item_matrix = user_item_matrix
         return user_item_matrix
     
+    @classmethod
+    def from_legacy(cls, legacy) -> 'CollaborativeFilter':
+        """Rebuild a filter pickled by releases that kept the matrix as a dense student x course DataFrame"""
+        collaborative_filter = cls(legacy.db)
+        frame = legacy.user_item_matrix
+        if frame is None or frame.empty:
+            return collaborative_filter
+        
+        frame = frame.sort_index().sort_index(axis=1)
+        collaborative_filter.user_ids = frame.index.to_numpy(dtype=np.int64)
+        collaborative_filter.course_ids = frame.columns.to_numpy(dtype=np.int64)
+        collaborative_filter.user_index = {int(user_id): i for i, user_id in enumerate(collaborative_filter.user_ids)}
+        collaborative_filter.course_index = {int(course_id): j for j, course_id in enumerate(collaborative_filter.course_ids)}
+        collaborative_filter.user_item_matrix = sparse.csr_matrix(frame.fillna(0).to_numpy(dtype=np.float32))
+        collaborative_filter.calculate_similarity()
+        return collaborative_filter
+    
+    def calculate_similarity(self):
+        """Build the neighbor index for the configured collaborative mode"""
+        self.mode = MODEL_CONFIG['collaborative_mode']
+        
+        if self.mode == 'item':
+            self.calculate_item_similarity()
+        else:
+            self.calculate_user_similarity()
+    
+    def calculate_item_similarity(self):
+        """Precompute the top-k most similar courses for every course"""
+        if self.user_item_matrix is None or self.user_item_matrix.shape[1] == 0:
+            return
+        
+        self.item_neighbor_indices, self.item_neighbor_similarities = top_k_cosine_neighbors(
+            self.user_item_matrix.T.tocsr(),
+            MODEL_CONFIG['n_item_neighbors'],
+            MODEL_CONFIG['similarity_block_size']
+        )
+    
     def calculate_user_similarity(self):
-        """Calculate user-user similarity matrix"""
-        if self.user_item_matrix is None or self.user_item_matrix.empty:
+        """Build the top-k user neighbor index"""
+        if self.user_item_matrix is None or self.user_item_matrix.shape[0] == 0:
             return
         
-        # Calculate cosine similarity
-        self.user_similarity = cosine_similarity(self.user_item_matrix)
-        self.user_similarity = pd.DataFrame(
-            self.user_similarity,
-            index=self.user_item_matrix.index,
-            columns=self.user_item_matrix.index
+        # Below lsh_min_users exact search is faster than LSH at any useful recall
+        if MODEL_CONFIG['neighbor_backend'] == 'lsh' and self.user_item_matrix.shape[0] >= MODEL_CONFIG['lsh_min_users']:
+            self.neighbor_indices, self.neighbor_similarities = lsh_cosine_neighbors(
+                self.user_item_matrix,
+                MODEL_CONFIG['n_neighbors'],
+                MODEL_CONFIG['lsh_tables'],
+                MODEL_CONFIG['lsh_max_bucket_size'],
+                MODEL_CONFIG['random_state']
+            )
+            self.neighbor_backend = 'lsh'
+        else:
+            self.neighbor_backend = 'exact'
+            self.neighbor_indices, self.neighbor_similarities = top_k_cosine_neighbors(
+                self.user_item_matrix,
+                MODEL_CONFIG['n_neighbors'],
+                MODEL_CONFIG['similarity_block_size']
+            )
+    
+    def estimate_neighbor_recall(self, sample_size: int = 500) -> Optional[float]:
+        """Fraction of the exact top-k neighbors above similarity_threshold found by the neighbor index"""
+        if self.neighbor_indices is None or self.neighbor_indices.shape[1] == 0:
+            return None
+        
+        rng = np.random.default_rng(MODEL_CONFIG['random_state'])
+        n_users = self.user_item_matrix.shape[0]
+        sample = rng.choice(n_users, size=min(sample_size, n_users), replace=False)
+        
+        exact_indices, exact_similarities = top_k_cosine_neighbors(
+            self.user_item_matrix,
+            self.neighbor_indices.shape[1],
+            MODEL_CONFIG['similarity_block_size'],
+            rows=sample
+        )
+        
+        found = total = 0
+        for i, user_idx in enumerate(sample):
+            relevant = exact_indices[i][exact_similarities[i] > MODEL_CONFIG['similarity_threshold']]
+            found += np.isin(relevant, self.neighbor_indices[user_idx]).sum()
+            total += relevant.size
+        
+        return found / total if total > 0 else None
+    
+    def is_fitted(self) -> bool:
+        """Whether the neighbor index for the current mode has been built"""
+        if self.mode == 'item':
+            return self.item_neighbor_indices is not None
+        return self.neighbor_indices is not None
+    
+    def score_users(self, user_idxs: np.ndarray) -> np.ndarray:
+        """Score every course for a batch of trained user rows with sparse matrix products"""
+        user_idxs = np.asarray(user_idxs)
+        if self.mode == 'item':
+            return self._score_rows(self.user_item_matrix[user_idxs])
+        return self._score_rows(
+            self.user_item_matrix[user_idxs], self.neighbor_indices[user_idxs], self.neighbor_similarities[user_idxs]
         )
     
+    def score_user_ids(self, user_ids: List[int]) -> np.ndarray:
+        """Score every course for a batch of students, using folded-in rows where present.
+        
+        Students that are neither in the trained matrix nor folded in get rows of -inf.
+        """
+        user_idxs = np.array([self.user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+        folded = [self.folded_users.get(user_id) for user_id in user_ids]
+        scores = np.full((len(user_ids), self.user_item_matrix.shape[1]), -np.inf)
+        
+        if all(state is None for state in folded):
+            known = user_idxs >= 0
+            if known.any():
+                scores[known] = self.score_users(user_idxs[known])
+            return scores
+        
+        positions = [i for i, state in enumerate(folded) if state is not None or user_idxs[i] >= 0]
+        rows = sparse.vstack([
+            folded[i][0] if folded[i] is not None else self.user_item_matrix[user_idxs[i]] for i in positions
+        ]).tocsr()
+        
+        if self.mode == 'item':
+            scores[positions] = self._score_rows(rows)
+        else:
+            neighbors = np.stack([
+                folded[i][1] if folded[i] is not None else self.neighbor_indices[user_idxs[i]] for i in positions
+            ])
+            similarities = np.stack([
+                folded[i][2] if folded[i] is not None else self.neighbor_similarities[user_idxs[i]] for i in positions
+            ])
+            scores[positions] = self._score_rows(rows, neighbors, similarities)
+        return scores
+    
+    def _score_rows(self, user_rows: sparse.csr_matrix, neighbors: np.ndarray = None,
+                    similarities: np.ndarray = None) -> np.ndarray:
+        """Score every course for the given interaction rows; user mode also takes each row's neighbors"""
+        if self.mode == 'item':
+            # Each enrolled course votes for its precomputed neighbors, weighted by similarity and
+            # by the user's rating; the sparse product only touches O(enrolled courses x k) entries
+            neighbor_weights, absolute_weights = self._item_neighbor_matrix()
+            user_rated = user_rows.copy()
+            user_rated.data = (user_rated.data > 0).astype(np.float32)
+            weighted_sum = (user_rows @ neighbor_weights).toarray()
+            similarity_sum = (user_rated @ absolute_weights).toarray()
+        else:
+            # Sparse (batch x distinct neighbors) weights, masked by the similarity threshold
+            mask = (similarities > MODEL_CONFIG['similarity_threshold']) & (neighbors >= 0)
+            distinct_neighbors, neighbor_cols = np.unique(neighbors[mask], return_inverse=True)
+            weights = sparse.csr_matrix(
+                (similarities[mask].astype(np.float64), (np.nonzero(mask)[0], neighbor_cols)),
+                shape=(user_rows.shape[0], len(distinct_neighbors))
+            )
+            neighbor_ratings = self.user_item_matrix[distinct_neighbors]
+            neighbor_rated = neighbor_ratings.copy()
+            neighbor_rated.data = (neighbor_rated.data > 0).astype(np.float64)
+            
+            # One weights x neighbor-rows product gives every course's weighted sum
+            weighted_sum = (weights @ neighbor_ratings).toarray()
+            similarity_sum = (abs(weights) @ neighbor_rated).toarray()
+        
+        scores = np.full(weighted_sum.shape, -np.inf)
+        scored = similarity_sum > 0
+        scores[scored] = weighted_sum[scored] / similarity_sum[scored]
+        
+        # Never recommend courses the user already has
+        user_rows = user_rows.tocoo()
+        owned = user_rows.data > 0
+        scores[user_rows.row[owned], user_rows.col[owned]] = -np.inf
+        return scores
+    
+    def _item_neighbor_matrix(self) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+        """Course x course sparse matrix of neighbor similarities above the threshold, and its absolute values"""
+        cached = self._item_neighbor_cache
+        if cached is not None and cached[0] is self.item_neighbor_indices:
+            return cached[1], cached[2]
+        
+        similarities = self.item_neighbor_similarities
+        mask = similarities > MODEL_CONFIG['similarity_threshold']
+        matrix = sparse.csr_matrix(
+            (similarities[mask], (np.nonzero(mask)[0], self.item_neighbor_indices[mask])),
+            shape=(similarities.shape[0], similarities.shape[0])
+        )
+        absolute = abs(matrix)
+        self._item_neighbor_cache = (self.item_neighbor_indices, matrix, absolute)
+        return matrix, absolute
+    
     def get_collaborative_recommendations(self, user_id: int, n_recommendations: int = 5) -> List[Tuple[int, float]]:
         """Get collaborative filtering recommendations for a user"""
-        if self.user_similarity is None or user_id not in self.user_similarity.index:
+        if not self.is_fitted() or (user_id not in self.user_index and user_id not in self.folded_users):
             return []
         
         try:
-            # Get similar users
-            similar_users = self.user_similarity.loc[user_id].sort_values(ascending=False)[1:]  # Exclude self
-            
-            # Get courses the user hasn't taken
-            user_courses = set(self.user_item_matrix.loc[user_id][self.user_item_matrix.loc[user_id] > 0].index)
-            all_courses = set(self.user_item_matrix.columns)
-            unrated_courses = all_courses - user_courses
-            
-            if not unrated_courses:
-                return []
+            scores = self.score_user_ids([user_id])[0]
+            top = top_n_indices(scores, n_recommendations)
+            return [(int(self.course_ids[j]), float(scores[j])) for j in top]
+        
+        except Exception as e:
+            logger.error(f"Error in collaborative recommendations for user {user_id}: {e}")
+            return []
+    
+    def user_row(self, user_id: int) -> sparse.csr_matrix:
+        """A student's current 1 x n_courses interaction row, including folded-in activity"""
+        folded = self.folded_users.get(user_id)
+        if folded is not None:
+            return folded[0]
+        if user_id in self.user_index:
+            return self.user_item_matrix[self.user_index[user_id]]
+        return sparse.csr_matrix((1, self.user_item_matrix.shape[1]), dtype=np.float32)
+    
+    def fold_in(self, user_id: int, course_statuses: List[Tuple[int, str]]) -> Optional[sparse.csr_matrix]:
+        """Apply a student's (course_id, completion_status) events to their row without retraining.
+        
+        The updated row and, in user mode, the student's recomputed neighbors go into
+        folded_users; the trained arrays are never written, so they may stay memory-mapped.
+        Returns the updated row, or None if none of the courses are in the trained matrix.
+        """
+        if not self.is_fitted():
+            return None
+        
+        updates = [(self.course_index[course_id], status) for course_id, status in course_statuses
+                   if course_id in self.course_index]
+        if not updates:
+            return None
+        
+        row = self.user_row(user_id)
+        values = dict(zip(row.indices.tolist(), row.data.tolist()))
+        for col, status in updates:
+            # Progress only moves forward, so an event never lowers an existing score
+            values[col] = max(values.get(col, 0.0), self.INTERACTION_SCORES[status])
+        
+        cols = np.array(sorted(values), dtype=np.int32)
+        data = np.array([values[c] for c in cols.tolist()], dtype=np.float32)
+        row = sparse.csr_matrix((data, cols, np.array([0, len(cols)])), shape=(1, self.user_item_matrix.shape[1]))
+        
+        neighbors = similarities = None
+        if self.mode != 'item':
+            neighbors, similarities = self._fold_in_neighbors(user_id, row)
+        
+        # One assignment, so readers see either the old state or the complete new one
+        self.folded_users[user_id] = (row, neighbors, similarities)
+        return row
+    
+    def _fold_in_neighbors(self, user_id: int, row: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k most similar trained users for one row, touching only users who share a course with it"""
+        k = self.neighbor_indices.shape[1]
+        columns, norms = self._column_view()
+        
+        values = row.data.astype(np.float64)
+        dots = columns[:, row.indices] @ values
+        row_norm = np.sqrt(values @ values)
+        
+        similarities = np.zeros(len(norms))
+        nonzero = (norms > 0) & (row_norm > 0)
+        similarities[nonzero] = dots[nonzero] / (norms[nonzero] * row_norm)
+        own = self.user_index.get(user_id)
+        if own is not None:
+            similarities[own] = -np.inf
+        
+        top = top_n_indices(similarities, k)
+        neighbors = np.full(k, -1, dtype=np.int32)
+        neighbor_similarities = np.zeros(k, dtype=np.float32)
+        neighbors[:len(top)] = top
+        neighbor_similarities[:len(top)] = similarities[top]
+        return neighbors, neighbor_similarities
+    
+    def _column_view(self) -> Tuple[sparse.csc_matrix, np.ndarray]:
+        """Column-major copy of the trained matrix and its row norms; saved with the artifact, else built on first use"""
+        cached = self._column_cache
+        if cached is None or cached[0] is not self.user_item_matrix:
+            matrix = self.user_item_matrix
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float64).ravel())
+            cached = (matrix, matrix.tocsc(), norms)
+            self._column_cache = cached
+        return cached[1], cached[2]
+    
+    def to_artifact(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """JSON metadata and named arrays describing the fitted filter"""
+        meta = {
+            'mode': self.mode,
+            'shape': list(self.user_item_matrix.shape) if self.user_item_matrix is not None else None
+        }
+        arrays = {
+            'user_ids': self.user_ids,
+            'course_ids': self.course_ids,
+            'neighbor_indices': self.neighbor_indices,
+            'neighbor_similarities': self.neighbor_similarities,
+            'item_neighbor_indices': self.item_neighbor_indices,
+            'item_neighbor_similarities': self.item_neighbor_similarities,
+            **csr_arrays(self.user_item_matrix, 'matrix')
+        }
+        if self.mode != 'item' and self.user_item_matrix is not None:
+            # Fold-in reads the matrix by column; saving that view lets every process map it instead of copying
+            columns, norms = self._column_view()
+            arrays.update(csr_arrays(columns, 'columns'))
+            arrays['row_norms'] = norms
+        return meta, arrays
+    
+    @classmethod
+    def from_artifact(cls, db_manager: DatabaseManager, meta: Dict, arrays: Dict[str, np.ndarray]) -> 'CollaborativeFilter':
+        """Restore a filter saved with to_artifact; arrays may be read-only memory maps"""
+        cf = cls(db_manager)
+        cf.mode = meta['mode']
+        cf.user_item_matrix = csr_from_arrays(arrays, 'matrix', meta['shape'])
+        cf.user_ids = arrays.get('user_ids')
+        cf.course_ids = arrays.get('course_ids')
+        cf.neighbor_indices = arrays.get('neighbor_indices')
+        cf.neighbor_similarities = arrays.get('neighbor_similarities')
+        cf.item_neighbor_indices = arrays.get('item_neighbor_indices')
+        cf.item_neighbor_similarities = arrays.get('item_neighbor_similarities')
+        if cf.user_ids is not None:
+            cf.user_index = dict(zip(cf.user_ids.tolist(), range(len(cf.user_ids))))
+            cf.course_index = dict(zip(cf.course_ids.tolist(), range(len(cf.course_ids))))
+        
+        columns = csc_from_arrays(arrays, 'columns', meta['shape'])
+        if columns is not None:
+            cf._column_cache = (cf.user_item_matrix, columns, arrays['row_norms'])
+        return cf
+    
+    def detach(self):
+        self.db = None
+
+class MatrixFactorizationFilter:
+    """Implicit-feedback matrix factorization (ALS) over the collaborative interaction scores"""
+    
+    def __init__(self, db_manager: DatabaseManager):
+        self.db = db_manager
+        self.user_index = {}  # student_id -> row of user_factors
+        self.course_ids = None  # row of item_factors -> course_id
+        self.user_factors = None  # (n_users, factors) float32
+        self.item_factors = None  # (n_courses, factors) float32
+        self.user_item_matrix = None
+        self.folded_users = {}  # student_id -> (factor vector, 1 x n_courses interaction row) since training
+        
+        self.n_factors = MODEL_CONFIG['als_factors']
+        self.n_iterations = MODEL_CONFIG['als_iterations']
+        self.regularization = MODEL_CONFIG['als_regularization']
+        self.alpha = MODEL_CONFIG['als_alpha']
+    
+    def fit(self, user_item_matrix: sparse.csr_matrix, user_index: Dict[int, int], course_ids: np.ndarray):
+        """Alternate least squares on confidence-weighted implicit preferences"""
+        if user_item_matrix is None or user_item_matrix.nnz == 0:
+            return
+        
+        self.user_item_matrix = user_item_matrix
+        self.user_index = user_index
+        self.course_ids = course_ids
+        
+        # Every interaction is a positive preference with confidence 1 + alpha * score
+        confidence = user_item_matrix.astype(np.float64)
+        confidence.data = 1.0 + self.alpha * confidence.data
+        confidence_t = confidence.T.tocsr()
+        
+        rng = np.random.default_rng(MODEL_CONFIG['random_state'])
+        n_users, n_courses = user_item_matrix.shape
+        user_factors = rng.normal(0, 0.01, (n_users, self.n_factors))
+        item_factors = rng.normal(0, 0.01, (n_courses, self.n_factors))
+        
+        for _ in range(self.n_iterations):
+            user_factors = self._least_squares(confidence, item_factors)
+            item_factors = self._least_squares(confidence_t, user_factors)
+        
+        self.user_factors = user_factors.astype(np.float32)
+        self.item_factors = item_factors.astype(np.float32)
+    
+    def _least_squares(self, confidence: sparse.csr_matrix, fixed: np.ndarray, max_block_nnz: int = 4096,
+                       max_outer_bytes: int = 256 * 1024 * 1024) -> np.ndarray:
+        """Solve every row's regularized least squares against the fixed factors.
+        
+        Rows are solved in blocks: the per-row normal equations are assembled with
+        sparse x dense products and handed to a single batched LAPACK solve.
+        """
+        n_rows, n_factors = confidence.shape[0], fixed.shape[1]
+        base = fixed.T @ fixed + self.regularization * np.eye(n_factors)
+        solution = np.zeros((n_rows, n_factors))
+        indptr = confidence.indptr
+        
+        # Outer products y y' of the fixed side are reused across rows when they fit in memory
+        fixed_outer = None
+        if fixed.shape[0] * n_factors * n_factors * 8 <= max_outer_bytes:
+            fixed_outer = (fixed[:, :, None] * fixed[:, None, :]).reshape(fixed.shape[0], -1)
+        
+        start = 0
+        while start < n_rows:
+            # Grow the block until it holds about max_block_nnz interactions
+            end = max(start + 1, int(np.searchsorted(indptr, indptr[start] + max_block_nnz, side='right')) - 1)
+            end = min(end, n_rows)
+            block = confidence[start:end]
             
-            # Calculate recommendation scores
-            recommendations = {}
+            # A_u = F'F + F_u' (C_u - I) F_u + reg * I,  b_u = F_u' C_u p_u
+            shifted = block.copy()
+            shifted.data = shifted.data - 1.0
+            if fixed_outer is not None:
+                extra = shifted @ fixed_outer
+            else:
+                factors = fixed[block.indices]
+                outer = (factors[:, :, None] * factors[:, None, :]).reshape(block.nnz, -1)
+                segments = sparse.csr_matrix((shifted.data, np.arange(block.nnz), block.indptr), shape=(end - start, block.nnz))
+                extra = segments @ outer
             
-            for course_id in unrated_courses:
-                score = 0
-                similarity_sum = 0
-                
-                for similar_user_id, similarity in similar_users.head(10).items():  # Top 10 similar users
-                    if similarity > MODEL_CONFIG['similarity_threshold']:
-                        user_rating = self.user_item_matrix.loc[similar_user_id, course_id]
-                        if user_rating > 0:
-                            score += similarity * user_rating
-                            similarity_sum += abs(similarity)
-                
-                if similarity_sum > 0:
-                    recommendations[course_id] = score / similarity_sum
+            lhs = base + extra.reshape(end - start, n_factors, n_factors)
+            rhs = block @ fixed
+            solution[start:end] = np.linalg.solve(lhs, rhs[..., None])[..., 0]
             
-            # Sort and return top recommendations
-            sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
-            return sorted_recommendations[:n_recommendations]
+            start = end
+        
+        return solution
+    
+    def fold_in(self, user_id: int, user_row: sparse.csr_matrix):
+        """Re-solve one student's factor against the fixed item factors after their row changed"""
+        if self.user_factors is None:
+            return
+        
+        confidence = user_row.astype(np.float64)
+        confidence.data = 1.0 + self.alpha * confidence.data
+        factor = self._least_squares(confidence, self.item_factors.astype(np.float64), max_outer_bytes=0)[0]
+        self.folded_users[user_id] = (factor.astype(np.float32), user_row)
+    
+    def score_users(self, user_idxs: np.ndarray) -> np.ndarray:
+        """Predicted preference for every course, one user factor x item factor product per row"""
+        user_idxs = np.asarray(user_idxs)
+        return self._score_factors(self.user_factors[user_idxs], self.user_item_matrix[user_idxs])
+    
+    def score_user_ids(self, user_ids: List[int]) -> np.ndarray:
+        """Predicted preferences for a batch of students, using folded-in factors where present.
+        
+        Students without a trained or folded-in factor get rows of -inf.
+        """
+        user_idxs = np.array([self.user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+        folded = [self.folded_users.get(user_id) for user_id in user_ids]
+        scores = np.full((len(user_ids), self.item_factors.shape[0]), -np.inf)
+        
+        positions = [i for i, state in enumerate(folded) if state is not None or user_idxs[i] >= 0]
+        if not positions:
+            return scores
+        
+        factors = np.stack([
+            folded[i][0] if folded[i] is not None else self.user_factors[user_idxs[i]] for i in positions
+        ])
+        rows = sparse.vstack([
+            folded[i][1] if folded[i] is not None else self.user_item_matrix[user_idxs[i]] for i in positions
+        ]).tocsr()
+        scores[positions] = self._score_factors(factors, rows)
+        return scores
+    
+    def _score_factors(self, factors: np.ndarray, user_rows: sparse.csr_matrix) -> np.ndarray:
+        """Factor x item factor scores, with courses already in each row set to -inf"""
+        # float64 products, so a student's scores do not depend on the batch they are computed in
+        scores = factors.astype(np.float64) @ self.item_factors.T.astype(np.float64)
+        
+        owned = user_rows.tocoo()
+        scores[owned.row, owned.col] = -np.inf
+        return scores
+    
+    def get_factorization_recommendations(self, user_id: int, n_recommendations: int = 5) -> List[Tuple[int, float]]:
+        """Score all courses with one user factor x item factor product"""
+        if self.user_factors is None or (user_id not in self.user_index and user_id not in self.folded_users):
+            return []
+        
+        try:
+            scores = self.score_user_ids([user_id])[0]
+            top = top_n_indices(scores, n_recommendations)
+            return [(int(self.course_ids[j]), float(scores[j])) for j in top]
         
         except Exception as e:
-            logger.error(f"Error in collaborative recommendations for user {user_id}: {e}")
+            logger.error(f"Error in factorization recommendations for user {user_id}: {e}")
             return []
     
+    def to_artifact(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """JSON metadata and named arrays describing the fitted factors"""
+        meta = {'n_factors': self.n_factors}
+        arrays = {
+            'course_ids': self.course_ids,
+            'user_factors': self.user_factors,
+            'item_factors': self.item_factors
+        }
+        return meta, arrays
+    
+    @classmethod
+    def from_artifact(cls, db_manager: DatabaseManager, meta: Dict, arrays: Dict[str, np.ndarray],
+                      collaborative_filter: CollaborativeFilter) -> 'MatrixFactorizationFilter':
+        """Restore saved factors; the id map and interaction matrix are shared with the collaborative filter"""
+        mf = cls(db_manager)
+        mf.n_factors = meta['n_factors']
+        mf.course_ids = arrays.get('course_ids')
+        mf.user_factors = arrays.get('user_factors')
+        mf.item_factors = arrays.get('item_factors')
+        if mf.user_factors is not None:
+            mf.user_index = collaborative_filter.user_index
+            mf.user_item_matrix = collaborative_filter.user_item_matrix
+        return mf
+    
     def detach(self):
         self.db = None
 
@@ -381,7 +1305,11 @@ class ContentBasedFilter:
         self.db = db_manager
         self.course_features = None
         self.tfidf_vectorizer = None
-        self.course_similarity = None
+        self.tfidf_matrix = None  # CSR, one L2-normalized TF-IDF row per course
+        self.course_ids = None  # row index -> course_id
+        self.course_index = {}  # course_id -> row index
+        self.popularity_scores = None  # enrollment_count scaled to [0, 1], per row
+        self.user_courses = {}  # student_id -> array of enrolled course_ids
     
     def build_course_features(self):
         """Build course feature matrix"""
@@ -397,62 +1325,303 @@ class ContentBasedFilter:
             courses['department_name'].fillna('')
         )
         
-        # TF-IDF vectorization of text features
+        # TF-IDF vectorization of text features; rows are L2-normalized, so dot products are cosines
         self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        tfidf_matrix = self.tfidf_vectorizer.fit_transform(courses['text_features'])
-        
-        # Calculate course similarity
-        self.course_similarity = cosine_similarity(tfidf_matrix)
-        self.course_similarity = pd.DataFrame(
-            self.course_similarity,
-            index=courses['course_id'],
-            columns=courses['course_id']
-        )
+        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(courses['text_features']).tocsr().astype(np.float32)
+        
+        self.course_ids = courses['course_id'].values
+        self.course_index = {int(course_id): i for i, course_id in enumerate(self.course_ids)}
+        
+        enrollment_counts = courses['enrollment_count'].fillna(0).values.astype(np.float64)
+        max_count = enrollment_counts.max() if len(enrollment_counts) else 0
+        self.popularity_scores = enrollment_counts / max_count if max_count > 0 else np.zeros(len(enrollment_counts))
         
         self.course_features = courses
     
+    def build_enrollment_index(self, collaborative_filter: 'CollaborativeFilter' = None):
+        """Index enrolled course ids by student so requests never query enrollments.
+        
+        Training passes the collaborative filter it just built: every enrollment with a
+        scored status is a stored entry of its interaction matrix, so the index is read off
+        the matrix instead of streaming the interactions a second time.
+        """
+        if collaborative_filter is not None and collaborative_filter.user_item_matrix is not None:
+            matrix = collaborative_filter.user_item_matrix
+            self.user_courses = {
+                int(user_id): collaborative_filter.course_ids[matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]]
+                for i, user_id in enumerate(collaborative_filter.user_ids)
+            }
+            return
+        
+        # Only the two id columns of the streamed interactions are kept
+        pairs = [chunk[['student_id', 'course_id']] for chunk in self.db.iter_interactions()]
+        enrollments = pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame()
+        
+        if enrollments.empty:
+            self.user_courses = {}
+            return
+        
+        self.user_courses = {
+            int(student_id): course_ids.unique()
+            for student_id, course_ids in enrollments.groupby('student_id')['course_id']
+        }
+    
+    def add_enrollment(self, user_id: int, course_id: int):
+        """Record a new enrollment in the index without retraining"""
+        user_courses = self.user_courses.get(user_id)
+        
+        if user_courses is None:
+            self.user_courses[user_id] = np.array([course_id])
+        elif course_id not in user_courses:
+            # Replace rather than mutate so concurrent readers see a complete array
+            self.user_courses[user_id] = np.append(user_courses, course_id)
+    
+    def score_user(self, user_courses) -> Optional[np.ndarray]:
+        """Mean cosine similarity of every course to the user's courses, or None if none are known"""
+        scores = self.score_users([user_courses])[0]
+        return scores if np.isfinite(scores).any() else None
+    
+    def score_users(self, users_courses: List) -> np.ndarray:
+        """Score the catalog for a batch of enrolled-course lists; rows with no known course are all -inf"""
+        rows, cols = [], []
+        for i, user_courses in enumerate(users_courses):
+            for course_id in user_courses:
+                j = self.course_index.get(int(course_id))
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+        
+        enrolled = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(users_courses), self.tfidf_matrix.shape[0])
+        )
+        enrolled.data[:] = 1.0  # Duplicate course ids count once
+        counts = np.asarray(enrolled.sum(axis=1)).ravel()
+        
+        # Sparse row-sums give the profiles; one sparse product scores the whole catalog
+        profiles = enrolled @ self.tfidf_matrix
+        scores = (profiles @ self.tfidf_matrix.T).toarray()
+        
+        known = counts > 0
+        scores[known] /= counts[known, None]
+        scores[~known] = -np.inf
+        
+        enrolled = enrolled.tocoo()
+        scores[enrolled.row, enrolled.col] = -np.inf
+        return scores
+    
+    def get_popular_recommendations(self, n_recommendations: int = 5) -> List[Tuple[int, float]]:
+        """Most enrolled courses, scored by their enrollment share"""
+        top = top_n_indices(self.popularity_scores, n_recommendations)
+        return [(int(self.course_ids[i]), float(self.popularity_scores[i])) for i in top]
+    
     def get_content_based_recommendations(self, user_id: int, n_recommendations: int = 5) -> List[Tuple[int, float]]:
         """Get content-based recommendations for a user"""
-        if self.course_features is None or self.course_similarity is None:
+        if self.tfidf_matrix is None:
             return []
         
         try:
             # Get user's enrolled courses
-            enrollments = self.db.get_enrollments_data()
-            user_courses = enrollments[enrollments['student_id'] == user_id]['course_id'].tolist()
+            user_courses = self.user_courses.get(user_id, np.array([])).tolist()
             
             if not user_courses:
                 # For new users, recommend popular courses
-                popular_courses = self.course_features.nlargest(n_recommendations, 'enrollment_count')
-                return [(row['course_id'], row['attractiveness_score']) for _, row in popular_courses.iterrows()]
+                return self.get_popular_recommendations(n_recommendations)
             
-            # Calculate scores for all courses
-            recommendations = {}
-            available_courses = set(self.course_similarity.index) - set(user_courses)
-            
-            for course_id in available_courses:
-                similarity_scores = []
-                for user_course_id in user_courses:
-                    if user_course_id in self.course_similarity.index:
-                        similarity = self.course_similarity.loc[user_course_id, course_id]
-                        similarity_scores.append(similarity)
-                
-                if similarity_scores:
-                    avg_similarity = np.mean(similarity_scores)
-                    recommendations[course_id] = avg_similarity
+            scores = self.score_user(user_courses)
+            if scores is None:
+                return []
             
-            # Sort and return top recommendations
-            sorted_recommendations = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
-            return sorted_recommendations[:n_recommendations]
+            top = top_n_indices(scores, n_recommendations)
+            return [(int(self.course_ids[i]), float(scores[i])) for i in top]
         
         except Exception as e:
             logger.error(f"Error in content-based recommendations for user {user_id}: {e}")
             return []
     
+    def to_artifact(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """JSON metadata and named arrays describing the fitted filter.
+        
+        The enrollment index is flattened into student ids, offsets and one course id array.
+        The fitted vectorizer and course DataFrame are not needed for serving and are left out.
+        """
+        enrolled_user_ids = np.array(sorted(self.user_courses), dtype=np.int64)
+        enrolled_courses = [np.asarray(self.user_courses[u], dtype=np.int64) for u in enrolled_user_ids.tolist()]
+        enrolled_indptr = np.zeros(len(enrolled_courses) + 1, dtype=np.int64)
+        enrolled_indptr[1:] = np.cumsum([len(courses) for courses in enrolled_courses])
+        
+        meta = {'tfidf_shape': list(self.tfidf_matrix.shape) if self.tfidf_matrix is not None else None}
+        arrays = {
+            'course_ids': self.course_ids,
+            'popularity_scores': self.popularity_scores,
+            'enrolled_user_ids': enrolled_user_ids,
+            'enrolled_indptr': enrolled_indptr,
+            'enrolled_course_ids': np.concatenate(enrolled_courses) if enrolled_courses else np.empty(0, dtype=np.int64),
+            **csr_arrays(self.tfidf_matrix, 'tfidf')
+        }
+        return meta, arrays
+    
+    @classmethod
+    def from_artifact(cls, db_manager: DatabaseManager, meta: Dict, arrays: Dict[str, np.ndarray]) -> 'ContentBasedFilter':
+        """Restore a filter saved with to_artifact; arrays may be read-only memory maps"""
+        cb = cls(db_manager)
+        cb.tfidf_matrix = csr_from_arrays(arrays, 'tfidf', meta['tfidf_shape'])
+        cb.course_ids = arrays.get('course_ids')
+        cb.popularity_scores = arrays.get('popularity_scores')
+        if cb.course_ids is not None:
+            cb.course_index = dict(zip(cb.course_ids.tolist(), range(len(cb.course_ids))))
+        
+        indptr = arrays['enrolled_indptr']
+        enrolled_course_ids = arrays['enrolled_course_ids']
+        cb.user_courses = {
+            user_id: enrolled_course_ids[indptr[i]:indptr[i + 1]]
+            for i, user_id in enumerate(arrays['enrolled_user_ids'].tolist())
+        }
+        return cb
+    
     def detach(self):
         self.db = None
 
 
+class CourseCatalog:
+    """Id-indexed course metadata used to format recommendation responses"""
+    
+    def __init__(self):
+        self.course_ids = np.empty(0, dtype=np.int64)
+        self.titles = []
+        self.descriptions = []
+        self.departments = []
+        self.enrollment_counts = np.empty(0, dtype=np.int64)
+        self.completion_rates = np.empty(0, dtype=np.float64)
+        self.index = {}  # course_id -> position
+    
+    @classmethod
+    def from_course_features(cls, course_features: pd.DataFrame) -> 'CourseCatalog':
+        """Build the catalog once from the course features DataFrame"""
+        catalog = cls()
+        if course_features is None or course_features.empty:
+            return catalog
+        
+        def text_column(name):
+            column = course_features[name]
+            return column.astype(object).where(column.notna(), None).tolist()
+        
+        catalog.course_ids = course_features['course_id'].values.astype(np.int64)
+        catalog.titles = text_column('title')
+        catalog.descriptions = text_column('description')
+        catalog.departments = text_column('department_name')
+        catalog.enrollment_counts = course_features['enrollment_count'].fillna(0).values.astype(np.int64)
+        catalog.completion_rates = course_features['completion_rate'].fillna(0).values.astype(np.float64)
+        catalog.index = {int(course_id): i for i, course_id in enumerate(catalog.course_ids)}
+        return catalog
+    
+    def to_artifact(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Text columns as JSON metadata, numeric columns as arrays"""
+        meta = {'titles': self.titles, 'descriptions': self.descriptions, 'departments': self.departments}
+        arrays = {
+            'course_ids': self.course_ids,
+            'enrollment_counts': self.enrollment_counts,
+            'completion_rates': self.completion_rates
+        }
+        return meta, arrays
+    
+    @classmethod
+    def from_artifact(cls, meta: Dict, arrays: Dict[str, np.ndarray]) -> 'CourseCatalog':
+        """Restore a catalog saved with to_artifact"""
+        catalog = cls()
+        catalog.course_ids = arrays['course_ids']
+        catalog.titles = meta['titles']
+        catalog.descriptions = meta['descriptions']
+        catalog.departments = meta['departments']
+        catalog.enrollment_counts = arrays['enrollment_counts']
+        catalog.completion_rates = arrays['completion_rates']
+        catalog.index = dict(zip(catalog.course_ids.tolist(), range(len(catalog.course_ids))))
+        return catalog
+    
+    def __len__(self) -> int:
+        return len(self.course_ids)
+    
+    def __contains__(self, course_id) -> bool:
+        return course_id in self.index
+    
+    def get(self, course_id: int, score: float = None) -> Optional[Dict]:
+        """Response dict for one course, or None if the course is unknown"""
+        i = self.index.get(course_id)
+        if i is None:
+            return None
+        return self.record(i, score)
+    
+    def record(self, i: int, score: float = None) -> Dict:
+        """Response dict for the course at catalog position i"""
+        return {
+            'course_id': int(self.course_ids[i]),
+            'title': self.titles[i],
+            'description': self.descriptions[i],
+            'department': self.departments[i],
+            'score': float(score) if score is not None else None,
+            'enrollment_count': int(self.enrollment_counts[i]),
+            'completion_rate': float(self.completion_rates[i])
+        }
+    
+    def format_recommendations(self, scored_courses: List[Tuple[int, float]]) -> List[Dict]:
+        """Response dicts for (course_id, score) pairs, skipping unknown courses"""
+        recommendations = []
+        for course_id, score in scored_courses:
+            recommendation = self.get(course_id, score)
+            if recommendation is not None:
+                recommendations.append(recommendation)
+        return recommendations
+
+
+class MaterializedRecommendations:
+    """Precomputed top-N recommendations for every known student, stored as flat arrays.
+    
+    Row r holds the course ids (padded with -1) and scores of student user_ids[r];
+    row_index maps a student id straight to its row, so a lookup is O(1). The arrays
+    are saved with the model artifact and can be memory-mapped back from disk.
+    """
+    
+    ARRAYS = ('user_ids', 'row_index', 'course_ids', 'scores')
+    
+    def __init__(self, user_ids: np.ndarray, course_ids: np.ndarray, scores: np.ndarray, n_recommendations: int):
+        self.user_ids = user_ids
+        self.course_ids = course_ids
+        self.scores = scores
+        self.n_recommendations = n_recommendations
+        self.row_index = np.full(int(user_ids.max()) + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+        self.row_index[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+        self.stale_users = set()  # Students whose rows no longer reflect their activity
+    
+    def lookup(self, user_id: int, n_recommendations: int) -> Optional[List[Tuple[int, float]]]:
+        """(course_id, score) pairs for a student, or None on a miss"""
+        if n_recommendations != self.n_recommendations or user_id in self.stale_users:
+            return None
+        if user_id < 0 or user_id >= len(self.row_index) or self.row_index[user_id] < 0:
+            return None
+        
+        row = self.row_index[user_id]
+        course_ids, scores = self.course_ids[row], self.scores[row]
+        return [(int(c), float(score)) for c, score in zip(course_ids, scores) if c >= 0]
+    
+    def invalidate(self, user_id: int):
+        """Stop serving a student's precomputed row until the next materialization"""
+        self.stale_users.add(user_id)
+    
+    def to_artifact(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """JSON metadata and named arrays describing the table"""
+        return {'n_recommendations': self.n_recommendations}, {name: getattr(self, name) for name in self.ARRAYS}
+    
+    @classmethod
+    def from_artifact(cls, meta: Dict, arrays: Dict[str, np.ndarray]) -> 'MaterializedRecommendations':
+        """Restore a table saved with to_artifact without rebuilding the row index"""
+        table = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(table, name, arrays[name])
+        table.n_recommendations = meta['n_recommendations']
+        table.stale_users = set()
+        return table
+
+
 class HybridRecommender:
     """Hybrid recommendation system combining collaborative and content-based filtering"""
     
@@ -460,26 +1629,83 @@ class HybridRecommender:
         self.db = db_manager
         self.collaborative_filter = CollaborativeFilter(db_manager)
         self.content_filter = ContentBasedFilter(db_manager)
+        self.mf_filter = MatrixFactorizationFilter(db_manager)
         self.feature_engineer = FeatureEngineer(db_manager)
         
         self.collaborative_weight = MODEL_CONFIG['collaborative_weight']
         self.content_weight = MODEL_CONFIG['content_weight']
+        self.mf_weight = MODEL_CONFIG['mf_weight']
         
+        self.course_catalog = CourseCatalog()
+        self.materialized = None
         self.is_trained = False
+        self.model_version = None  # Timestamp of the training run, also the artifact version name
+        self.training_started_at = None  # When train() started reading data; later activity is not in the model
+        self.training_seconds = None  # Wall time of the training run, kept in the artifact manifest
     
     def train(self):
         """Train the hybrid recommendation model"""
         logger.info("Starting model training...")
+        self.training_started_at = datetime.now()
+        start = time.perf_counter()
         
         # Train collaborative filtering
         self.collaborative_filter.build_user_item_matrix()
-        self.collaborative_filter.calculate_user_similarity()
+        self.collaborative_filter.calculate_similarity()
+        
+        # Train matrix factorization on the same interaction matrix
+        if self.mf_weight > 0:
+            self.mf_filter.fit(
+                self.collaborative_filter.user_item_matrix,
+                self.collaborative_filter.user_index,
+                self.collaborative_filter.course_ids
+            )
         
         # Train content-based filtering
         self.content_filter.build_course_features()
+        self.content_filter.build_enrollment_index(self.collaborative_filter)
+        
+        # Course metadata for formatting responses
+        self.course_catalog = CourseCatalog.from_course_features(self.content_filter.course_features)
         
         self.is_trained = True
-        logger.info("Model training completed")
+        self.model_version = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        
+        # Precompute top-N for every known student
+        self.materialized = None
+        if TRAINING_CONFIG['materialize_recommendations']:
+            self.materialize()
+        
+        self.training_seconds = time.perf_counter() - start
+        TRAINING_SECONDS.observe(self.training_seconds)
+        logger.info(f"Model training completed in {self.training_seconds:.1f}s")
+    
+    def known_user_ids(self) -> np.ndarray:
+        """Every student the trained components know about"""
+        user_ids = set(self.collaborative_filter.user_index) | set(self.content_filter.user_courses)
+        return np.array(sorted(user_ids), dtype=np.int64)
+    
+    def materialize(self, n_recommendations: int = None):
+        """Compute and keep the top-N table for every known student"""
+        if n_recommendations is None:
+            n_recommendations = MODEL_CONFIG['n_recommendations']
+        
+        user_ids = self.known_user_ids()
+        course_ids = np.full((len(user_ids), n_recommendations), -1, dtype=np.int64)
+        scores = np.zeros((len(user_ids), n_recommendations), dtype=np.float64)
+        
+        catalog_columns = self._catalog_columns()
+        chunk_size = MODEL_CONFIG['batch_chunk_size']
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size].tolist()
+            top, top_scores = self._score_chunk(chunk, n_recommendations, catalog_columns)
+            
+            finite = np.isfinite(top_scores)
+            course_ids[start:start + len(chunk)] = np.where(finite, self.course_catalog.course_ids[top], -1)
+            scores[start:start + len(chunk)] = np.where(finite, top_scores, 0.0)
+        
+        self.materialized = MaterializedRecommendations(user_ids, course_ids, scores, n_recommendations)
+        logger.info(f"Materialized top-{n_recommendations} recommendations for {len(user_ids)} students")
     
     def get_recommendations(self, user_id: int, n_recommendations: int = None) -> List[Dict]:
         """Get hybrid recommendations for a user"""
@@ -490,118 +1716,420 @@ class HybridRecommender:
         if n_recommendations is None:
             n_recommendations = MODEL_CONFIG['n_recommendations']
         
-        # Get recommendations from both approaches
-        collaborative_recs = self.collaborative_filter.get_collaborative_recommendations(user_id, n_recommendations * 2)
-        content_recs = self.content_filter.get_content_based_recommendations(user_id, n_recommendations * 2)
+        # Serve precomputed results when available
+        if self.materialized is not None:
+            with RECOMMENDATION_STAGE_SECONDS.time(stage='materialized_lookup'):
+                materialized = self.materialized.lookup(user_id, n_recommendations)
+            if materialized is not None:
+                with RECOMMENDATION_STAGE_SECONDS.time(stage='format'):
+                    return self.course_catalog.format_recommendations(materialized)
         
-        # Combine recommendations
-        combined_scores = {}
+        # Get recommendations from all approaches
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='collaborative'):
+            collaborative_recs = self.collaborative_filter.get_collaborative_recommendations(user_id, n_recommendations * 2)
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='content'):
+            content_recs = self.content_filter.get_content_based_recommendations(user_id, n_recommendations * 2)
+        mf_recs = []
+        if self.mf_weight > 0:
+            with RECOMMENDATION_STAGE_SECONDS.time(stage='mf'):
+                mf_recs = self.mf_filter.get_factorization_recommendations(user_id, n_recommendations * 2)
         
-        # Add collaborative filtering scores
-        for course_id, score in collaborative_recs:
-            combined_scores[course_id] = score * self.collaborative_weight
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='merge'):
+            # Combine recommendations
+            combined_scores = {}
+            
+            # Add collaborative filtering scores
+            for course_id, score in collaborative_recs:
+                combined_scores[course_id] = score * self.collaborative_weight
+            
+            # Add content-based scores
+            for course_id, score in content_recs:
+                if course_id in combined_scores:
+                    combined_scores[course_id] += score * self.content_weight
+                else:
+                    combined_scores[course_id] = score * self.content_weight
+            
+            # Add matrix factorization scores
+            for course_id, score in mf_recs:
+                combined_scores[course_id] = combined_scores.get(course_id, 0.0) + score * self.mf_weight
+            
+            # Sort and get top recommendations
+            sorted_recommendations = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)
+            top_recommendations = sorted_recommendations[:n_recommendations]
         
-        # Add content-based scores
-        for course_id, score in content_recs:
-            if course_id in combined_scores:
-                combined_scores[course_id] += score * self.content_weight
-            else:
-                combined_scores[course_id] = score * self.content_weight
+        # Get course details
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='format'):
+            return self.course_catalog.format_recommendations(top_recommendations)
+    
+    def get_popular_recommendations(self, user_id: int, n_recommendations: int = None) -> List[Dict]:
+        """Most enrolled courses the user is not enrolled in; no per-user scoring, so cheap under load"""
+        if n_recommendations is None:
+            n_recommendations = MODEL_CONFIG['n_recommendations']
+        if self.content_filter.popularity_scores is None:
+            return []
         
-        # Sort and get top recommendations
-        sorted_recommendations = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)
-        top_recommendations = sorted_recommendations[:n_recommendations]
+        enrolled = set(self.content_filter.user_courses.get(user_id, np.array([])).tolist())
+        popular = self.content_filter.get_popular_recommendations(n_recommendations + len(enrolled))
+        return self.course_catalog.format_recommendations(
+            [(course_id, score) for course_id, score in popular if course_id not in enrolled][:n_recommendations]
+        )
+    
+    def get_recommendations_batch(self, user_ids: List[int], n_recommendations: int = None) -> Dict[int, List[Dict]]:
+        """Get hybrid recommendations for many users, scoring each chunk of users with matrix operations"""
+        if not self.is_trained:
+            logger.warning("Model not trained. Training now...")
+            self.train()
         
-        # Get course details
-        course_features = self.content_filter.course_features
-        recommendations_with_details = []
-        
-        for course_id, score in top_recommendations:
-            if course_features is not None and course_id in course_features['course_id'].values:
-                course_info = course_features[course_features['course_id'] == course_id].iloc[0]
-                recommendations_with_details.append({
-                    'course_id': int(course_id),
-                    'title': course_info['title'],
-                    'description': course_info['description'],
-                    'department': course_info['department_name'],
-                    'score': float(score),
-                    'enrollment_count': int(course_info['enrollment_count']),
-                    'completion_rate': float(course_info['completion_rate'])
-                })
-        
-        return recommendations_with_details
-    
-    def save_model(self, filepath: str):
-        """Save the trained model safely without pickling database connection"""
+        if n_recommendations is None:
+            n_recommendations = MODEL_CONFIG['n_recommendations']
+        
+        catalog_columns = self._catalog_columns()
+        
+        recommendations = {}
+        chunk_size = MODEL_CONFIG['batch_chunk_size']
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = [int(user_id) for user_id in user_ids[start:start + chunk_size]]
+            recommendations.update(self._recommend_chunk(chunk, n_recommendations, catalog_columns))
+        
+        return recommendations
+    
+    def _catalog_columns(self) -> Dict[str, np.ndarray]:
+        """Map every component's course columns onto catalog positions (-1 if not in the catalog)"""
+        return {
+            name: np.array([self.course_catalog.index.get(int(c), -1) for c in course_ids], dtype=np.int64)
+            for name, course_ids in [
+                ('collaborative', self.collaborative_filter.course_ids),
+                ('content', self.content_filter.course_ids),
+                ('mf', self.mf_filter.course_ids)
+            ] if course_ids is not None
+        }
+    
+    def _component_scores(self, user_ids: List[int]):
+        """Yield (name, scores, weight) for every component, one row of scores per user"""
+        cf = self.collaborative_filter
+        if cf.user_item_matrix is not None and cf.is_fitted():
+            yield 'collaborative', cf.score_user_ids(user_ids), self.collaborative_weight
+        
+        cb = self.content_filter
+        if cb.tfidf_matrix is not None:
+            users_courses = [cb.user_courses.get(user_id, ()) for user_id in user_ids]
+            scores = cb.score_users(users_courses)
+            # New users get popular courses, as in get_content_based_recommendations
+            new_users = np.array([len(courses) == 0 for courses in users_courses])
+            scores[new_users] = cb.popularity_scores
+            yield 'content', scores, self.content_weight
+        
+        mf = self.mf_filter
+        if self.mf_weight > 0 and mf.user_factors is not None:
+            yield 'mf', mf.score_user_ids(user_ids), self.mf_weight
+    
+    def _score_chunk(self, user_ids: List[int], n_recommendations: int,
+                     catalog_columns: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge each component's top 2N per user into catalog-wide scores; return top-N positions and scores"""
+        combined = np.full((len(user_ids), len(self.course_catalog)), -np.inf)
+        
+        for name, scores, weight in self._component_scores(user_ids):
+            top = top_n_per_row(scores, n_recommendations * 2)
+            top_scores = np.take_along_axis(scores, top, axis=1).ravel()
+            rows = np.repeat(np.arange(len(user_ids)), top.shape[1])
+            cols = catalog_columns[name][top.ravel()]
+            
+            keep = np.isfinite(top_scores) & (cols >= 0)
+            rows, cols, top_scores = rows[keep], cols[keep], top_scores[keep]
+            current = combined[rows, cols]
+            combined[rows, cols] = np.where(np.isfinite(current), current, 0.0) + top_scores * weight
+        
+        top = top_n_per_row(combined, n_recommendations)
+        return top, np.take_along_axis(combined, top, axis=1)
+    
+    def _recommend_chunk(self, user_ids: List[int], n_recommendations: int,
+                         catalog_columns: Dict[str, np.ndarray]) -> Dict[int, List[Dict]]:
+        """Formatted top-N recommendations for one chunk of users"""
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='batch_scoring'):
+            top, top_scores = self._score_chunk(user_ids, n_recommendations, catalog_columns)
+        
+        with RECOMMENDATION_STAGE_SECONDS.time(stage='batch_format'):
+            return {
+                user_id: [
+                    self.course_catalog.record(i, score)
+                    for i, score in zip(top[row], top_scores[row]) if np.isfinite(score)
+                ]
+                for row, user_id in enumerate(user_ids)
+            }
+    
+    def save_model(self, directory: str):
+        """Save the trained model as a new version of the artifact directory.
+        
+        Every version holds manifest.json, one JSON document per component and each array
+        as a .npy file. The CURRENT file names the live version and is replaced atomically,
+        so readers never open a half-written model.
+        """
         try:
-            # Tách db connection trước khi lưu
-            self.collaborative_filter.detach()
-            self.content_filter.detach()
-            self.feature_engineer.detach()
-
-            model_data = {
-                'collaborative_filter': self.collaborative_filter,
-                'content_filter': self.content_filter,
-                'feature_engineer': self.feature_engineer,
+            version = self.model_version or datetime.now().strftime('%Y%m%d%H%M%S%f')
+            version_dir = os.path.join(directory, version)
+            os.makedirs(version_dir, exist_ok=True)
+            
+            components = {
+                'collaborative': self.collaborative_filter,
+                'content': self.content_filter,
+                'mf': self.mf_filter,
+                'catalog': self.course_catalog
+            }
+            if self.materialized is not None:
+                components['materialized'] = self.materialized
+            
+            arrays = {}
+            for name, component in components.items():
+                meta, component_arrays = component.to_artifact()
+                with open(os.path.join(version_dir, f"{name}.json"), 'w') as f:
+                    json.dump(meta, f)
+                
+                for key, array in component_arrays.items():
+                    if array is None:
+                        continue
+                    array_name = f"{name}.{key}"
+                    np.save(os.path.join(version_dir, f"{array_name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+                    arrays[array_name] = {'dtype': str(array.dtype), 'shape': list(array.shape)}
+            
+            manifest = {
+                'format_version': ARTIFACT_FORMAT_VERSION,
+                'model_version': version,
+                'created_at': datetime.now().isoformat(),
                 'is_trained': self.is_trained,
-                'model_timestamp': datetime.now()
+                'training_seconds': self.training_seconds,
+                'training_started_at': self.training_started_at.isoformat() if self.training_started_at else None,
+                'collaborative_mode': self.collaborative_filter.mode,
+                'components': list(components),
+                'arrays': arrays
             }
-
-            with open(filepath, 'wb') as f:
-                pickle.dump(model_data, f)
-
-            logger.info(f"Model saved to {filepath}")
+            with open(os.path.join(version_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            
+            pointer_path = os.path.join(directory, 'CURRENT')
+            with open(pointer_path + '.tmp', 'w') as f:
+                f.write(version)
+            os.replace(pointer_path + '.tmp', pointer_path)
+            
+            self.prune_artifact_versions(directory, keep=TRAINING_CONFIG['artifact_keep_versions'])
+            logger.info(f"Model version {version} saved to {directory}")
         except Exception as e:
             logger.error(f"Failed to save model: {e}")
     
+    @staticmethod
+    def has_artifact(directory: str) -> bool:
+        """Whether a model version has been published to the directory; it may exist only for marker files"""
+        return os.path.exists(os.path.join(directory, 'CURRENT'))
+    
+    @staticmethod
+    def artifact_version_dir(directory: str) -> str:
+        """Directory of the version CURRENT points at"""
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            return os.path.join(directory, f.read().strip())
+    
+    @classmethod
+    def artifact_info(cls, directory: str) -> Dict:
+        """Manifest summary and on-disk size of the current artifact version"""
+        version_dir = cls.artifact_version_dir(directory)
+        with open(os.path.join(version_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        
+        return {
+            'format_version': manifest['format_version'],
+            'model_version': manifest['model_version'],
+            'created_at': manifest['created_at'],
+            'training_seconds': manifest.get('training_seconds'),
+            'size_bytes': sum(entry.stat().st_size for entry in os.scandir(version_dir) if entry.is_file())
+        }
+    
     @classmethod
-    def load_model(cls, filepath: str, db_manager: DatabaseManager):
-        """Load a trained model and restore DB connections"""
+    def prune_artifact_versions(cls, directory: str, keep: int = 2):
+        """Delete all but the newest `keep` versions, never the current one.
+        
+        Processes that still have an old version memory-mapped keep reading it until they reload.
+        """
+        current = os.path.basename(cls.artifact_version_dir(directory))
+        versions = sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+        for version in versions[:-keep] if keep > 0 else versions:
+            if version != current:
+                shutil.rmtree(os.path.join(directory, version), ignore_errors=True)
+    
+    @classmethod
+    def load_model(cls, path: str, db_manager: DatabaseManager, mmap_mode: str = 'r'):
+        """Load a trained model from an artifact directory, or from a legacy pickle file"""
         try:
-            with open(filepath, 'rb') as f:
-                model_data = pickle.load(f)
-
-            recommender = cls(db_manager)
-            recommender.collaborative_filter = model_data['collaborative_filter']
-            recommender.collaborative_filter.db = db_manager
-
-            recommender.content_filter = model_data['content_filter']
-            recommender.content_filter.db = db_manager
-
-            recommender.feature_engineer = model_data['feature_engineer']
-            recommender.feature_engineer.db = db_manager
-
-            recommender.is_trained = model_data['is_trained']
-
-            logger.info(f"Model loaded from {filepath}")
+            if os.path.isdir(path):
+                recommender = cls._load_artifact(path, db_manager, mmap_mode)
+            else:
+                recommender = cls._load_pickle(path, db_manager)
+            
+            logger.info(f"Model loaded from {path}")
             return recommender
-
+        
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             return None
+    
+    @classmethod
+    def _load_artifact(cls, directory: str, db_manager: DatabaseManager, mmap_mode: str = 'r'):
+        """Open the current artifact version, memory-mapping every array"""
+        version_dir = cls.artifact_version_dir(directory)
+        with open(os.path.join(version_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        
+        if manifest['format_version'] != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model artifact format {manifest['format_version']}")
+        
+        arrays = {
+            name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in manifest['arrays']
+        }
+        
+        def component(name):
+            with open(os.path.join(version_dir, f"{name}.json")) as f:
+                meta = json.load(f)
+            prefix = f"{name}."
+            return meta, {key[len(prefix):]: array for key, array in arrays.items() if key.startswith(prefix)}
+        
+        recommender = cls(db_manager)
+        recommender.collaborative_filter = CollaborativeFilter.from_artifact(db_manager, *component('collaborative'))
+        recommender.content_filter = ContentBasedFilter.from_artifact(db_manager, *component('content'))
+        recommender.mf_filter = MatrixFactorizationFilter.from_artifact(
+            db_manager, *component('mf'), recommender.collaborative_filter
+        )
+        recommender.course_catalog = CourseCatalog.from_artifact(*component('catalog'))
+        if 'materialized' in manifest['components']:
+            recommender.materialized = MaterializedRecommendations.from_artifact(*component('materialized'))
+        
+        recommender.is_trained = manifest['is_trained']
+        recommender.model_version = manifest['model_version']
+        recommender.training_seconds = manifest.get('training_seconds')  # Not recorded by older artifacts
+        # Workers replay activity folded in after this onto the model; older artifacts do not record it
+        if manifest.get('training_started_at'):
+            recommender.training_started_at = datetime.fromisoformat(manifest['training_started_at'])
+        return recommender
+    
+    @classmethod
+    def _load_pickle(cls, filepath: str, db_manager: DatabaseManager):
+        """Read a model pickled by older releases"""
+        with open(filepath, 'rb') as f:
+            model_data = pickle.load(f)
+        
+        recommender = cls(db_manager)
+        recommender.collaborative_filter = model_data['collaborative_filter']
+        recommender.collaborative_filter.db = db_manager
+        if not hasattr(recommender.collaborative_filter, 'user_index'):
+            # Models saved before the sparse matrix existed hold a DataFrame; convert it and rebuild the neighbors
+            recommender.collaborative_filter = CollaborativeFilter.from_legacy(recommender.collaborative_filter)
+        
+        recommender.content_filter = model_data['content_filter']
+        recommender.content_filter.db = db_manager
+        if not hasattr(recommender.content_filter, 'tfidf_matrix'):
+            # Models saved before the sparse serving path existed are rebuilt
+            recommender.content_filter = ContentBasedFilter(db_manager)
+            recommender.content_filter.build_course_features()
+            recommender.content_filter.build_enrollment_index()
+        
+        if 'mf_filter' in model_data:
+            recommender.mf_filter = model_data['mf_filter']
+            recommender.mf_filter.db = db_manager
+        elif recommender.mf_weight > 0 and recommender.collaborative_filter.user_item_matrix is not None:
+            # Factorize the pickled interactions, as train() would have
+            recommender.mf_filter.fit(
+                recommender.collaborative_filter.user_item_matrix,
+                recommender.collaborative_filter.user_index,
+                recommender.collaborative_filter.course_ids
+            )
+        
+        if 'course_catalog' in model_data:
+            recommender.course_catalog = model_data['course_catalog']
+        else:
+            recommender.course_catalog = CourseCatalog.from_course_features(recommender.content_filter.course_features)
+        
+        # The feature engineer only holds configuration, so the current one from __init__ is kept
+        
+        recommender.is_trained = model_data['is_trained']
+        recommender.model_version = model_data['model_timestamp'].strftime('%Y%m%d%H%M%S%f')
+        
+        if recommender.is_trained and TRAINING_CONFIG['materialize_recommendations']:
+            recommender.materialize()
+        return recommender
 
 
 class IncrementalRecommender:
-    """Handles incremental updates to the recommendation system"""
+    """Folds new activity into a trained model without retraining"""
     
-    def __init__(self, recommender: HybridRecommender):
+    def __init__(self, recommender: HybridRecommender, on_fold_in: Optional[Callable[[int], None]] = None):
         self.recommender = recommender
-        self.last_update = datetime.now()
+        self.on_fold_in = on_fold_in  # Called with the student id after their activity changed the model
+        self.created_at = datetime.now()
+        self.last_update = self.created_at
+        # Recent foldable activity, replayed onto a retrained model that started reading data before it
+        self.recent_activities = deque(maxlen=REFRESH_CONFIG['replay_buffer_size'])
+        self._lock = threading.Lock()
     
     def update_with_new_activity(self, user_id: int, activity_type: str, course_id: int = None):
         """Update recommendations based on new user activity"""
         try:
-            # For now, we'll trigger a lightweight retrain
-            # In a production system, this could be more sophisticated
-            if (datetime.now() - self.last_update).total_seconds() > 1800:  # 30 minutes
-                logger.info("Performing incremental update...")
-                self.recommender.train()
-                self.last_update = datetime.now()
+            self.apply_batch({user_id: [(activity_type, course_id)]})
         
         except Exception as e:
             logger.error(f"Error in incremental update: {e}")
     
+    def apply_batch(self, activities: Dict[int, List[Tuple[str, Optional[int]]]]) -> int:
+        """Fold in (activity_type, course_id) events grouped by student; returns students updated"""
+        now = datetime.now()
+        updated = 0
+        for user_id, events in activities.items():
+            foldable = [(activity_type, course_id) for activity_type, course_id in events
+                        if course_id is not None and activity_type in REFRESH_CONFIG['activity_completion_status']]
+            if not foldable:
+                continue
+            
+            self.fold_in(user_id, foldable)
+            self.recent_activities.extend((now, user_id, activity_type, course_id) for activity_type, course_id in foldable)
+            updated += 1
+        
+        if updated:
+            self.last_update = now
+        return updated
+    
+    def fold_in(self, user_id: int, events: List[Tuple[str, int]]):
+        """Update only this student's enrollment index, interaction row, neighbors and factor.
+        
+        Every event must imply an enrollment. Full retrains build a new model in the
+        background on the full_retrain_hours schedule instead.
+        """
+        completion_status = REFRESH_CONFIG['activity_completion_status']
+        course_statuses = [(course_id, completion_status[activity_type]) for activity_type, course_id in events]
+        
+        model = self.recommender
+        with self._lock:
+            for course_id, _ in course_statuses:
+                model.content_filter.add_enrollment(user_id, course_id)
+            
+            # Neighbors and the factor are recomputed once for all of the student's events
+            row = model.collaborative_filter.fold_in(user_id, course_statuses)
+            if row is not None and model.mf_weight > 0:
+                model.mf_filter.fold_in(user_id, row)
+            
+            if model.materialized is not None:
+                model.materialized.invalidate(user_id)
+            
+            if self.on_fold_in is not None:
+                self.on_fold_in(user_id)
+    
+    def activities_since(self, timestamp: datetime) -> List[Tuple]:
+        """Recorded (time, user_id, activity_type, course_id) events at or after timestamp"""
+        return [activity for activity in list(self.recent_activities) if activity[0] >= timestamp]
+    
+    def replay(self, activities: List[Tuple]):
+        """Fold in events recorded by another IncrementalRecommender, keeping them for later replays"""
+        grouped = {}
+        for _, user_id, activity_type, course_id in activities:
+            grouped.setdefault(user_id, []).append((activity_type, course_id))
+        self.apply_batch(grouped)
+    
     def should_retrain(self) -> bool:
         """Determine if model should be retrained"""
-        time_since_update = (datetime.now() - self.last_update).total_seconds()
-        return time_since_update > 3600  # 1 hour
\ No newline at end of file
+        time_since_publish = (datetime.now() - self.created_at).total_seconds()
+        return time_since_publish > REFRESH_CONFIG['full_retrain_hours'] * 3600
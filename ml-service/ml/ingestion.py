@@ -0,0 +1,244 @@
+"""
+Buffered activity ingestion for the Course Recommendation System
+Queues activity events from the API and folds them into the live model in batches
+"""
+
+import os
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import INGESTION_CONFIG
+from core import IncrementalRecommender
+
+logger = logging.getLogger(__name__)
+
+class ActivityLog:
+    """Append-only activity events shared by the serving workers of the prefork server.
+    
+    The load balancer hands each worker only part of the activity, so every worker
+    appends the events it applied to an hourly segment file and tails the lines the
+    others appended. Each batch is one O_APPEND write, so concurrent writers never
+    interleave inside a line, and a reader leaves a partial last line for its next pass.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.pid = os.getpid()
+        self._offsets: Dict[str, int] = {}  # Segment file name -> bytes already read
+        os.makedirs(directory, exist_ok=True)
+    
+    @staticmethod
+    def _segment_name(at: datetime) -> str:
+        return at.strftime('%Y%m%d%H') + '.log'
+    
+    def append(self, events: List[Tuple[int, str, Optional[int]]]):
+        """Record (user_id, activity_type, course_id) events this process applied"""
+        if not events:
+            return
+        
+        now = datetime.now()
+        lines = ''.join(
+            json.dumps({'pid': self.pid, 'at': now.isoformat(), 'user_id': user_id,
+                        'activity_type': activity_type, 'course_id': course_id}) + '\n'
+            for user_id, activity_type, course_id in events
+        )
+        fd = os.open(os.path.join(self.directory, self._segment_name(now)), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode('utf-8'))
+        finally:
+            os.close(fd)
+    
+    def read_new(self, since: datetime = None) -> List[Tuple[int, str, Optional[int]]]:
+        """Events other processes appended since the last call, skipping those before since"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.log'))
+        first_segment = self._segment_name(since) if since is not None else None
+        
+        events = []
+        for name in names:
+            offset = self._offsets.get(name, 0)
+            if first_segment is not None and name < first_segment:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            
+            complete = data.rfind(b'\n') + 1
+            self._offsets[name] = offset + complete
+            for line in data[:complete].splitlines():
+                event = json.loads(line)
+                if event['pid'] == self.pid:
+                    continue
+                if since is not None and datetime.fromisoformat(event['at']) < since:
+                    continue
+                events.append((event['user_id'], event['activity_type'], event['course_id']))
+        
+        # Forget segments the trainer pruned
+        self._offsets = {name: offset for name, offset in self._offsets.items() if name in names}
+        return events
+    
+    @classmethod
+    def prune(cls, directory: str, before: datetime):
+        """Delete segments that end before the given time; the published model already holds their events"""
+        if not os.path.isdir(directory):
+            return
+        
+        last_needed = cls._segment_name(before)
+        for name in os.listdir(directory):
+            if name.endswith('.log') and name < last_needed:
+                os.remove(os.path.join(directory, name))
+
+class ActivityIngestor:
+    """Bounded activity queue drained by one background consumer.
+    
+    The consumer coalesces each batch per student, dropping repeated events, and hands
+    it to whatever IncrementalRecommender get_target returns at that moment, so events
+    always land on the published model. With an ActivityLog it also records each batch
+    there and applies the batches other workers recorded.
+    """
+    
+    def __init__(self, get_target: Callable[[], Optional[IncrementalRecommender]], activity_log: ActivityLog = None):
+        self.get_target = get_target
+        self.activity_log = activity_log
+        self.queue = queue.Queue(maxsize=INGESTION_CONFIG['queue_size'])
+        self.batch_size = INGESTION_CONFIG['batch_size']
+        self.flush_interval = INGESTION_CONFIG['flush_interval_seconds']
+        
+        self._stats_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,
+            'dropped': 0,  # Rejected because the queue was full
+            'applied': 0,  # Events handed to the model after coalescing
+            'coalesced': 0,  # Duplicate events merged away
+            'failed': 0,  # Events lost to errors while applying a batch
+            'shared': 0,  # Events other workers received, read from the activity log
+            'batches': 0
+        }
+        self.last_batch_seconds = 0.0
+        self.last_batch_at = None
+        
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start the background consumer"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='activity-ingestion', daemon=True)
+        self._thread.start()
+        logger.info("Activity ingestion consumer started")
+    
+    def stop(self, timeout: float = 5.0):
+        """Stop the consumer after it applies what is already queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def submit(self, user_id: int, activity_type: str, course_id: int = None) -> bool:
+        """Queue one event without blocking; False means the queue is full and the event was dropped"""
+        try:
+            self.queue.put_nowait((user_id, activity_type, course_id))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        
+        self._count('enqueued')
+        return True
+    
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.counters[name] += amount
+    
+    def _run(self):
+        """Drain the queue in batches until stopped and empty"""
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._apply(batch)
+            if self.activity_log is not None:
+                self._apply_shared()
+    
+    def _next_batch(self) -> list:
+        """Block for the first event, then collect more for up to flush_interval or batch_size events"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _apply(self, batch: list, record: bool = True):
+        """Coalesce a batch per student and fold it into the current model, recording it in the activity log"""
+        start = time.time()
+        
+        activities: Dict[int, list] = {}
+        for user_id, activity_type, course_id in batch:
+            events = activities.setdefault(user_id, [])
+            if (activity_type, course_id) not in events:
+                events.append((activity_type, course_id))
+        n_events = sum(len(events) for events in activities.values())
+        
+        try:
+            target = self.get_target()
+            if target is not None:
+                target.apply_batch(activities)
+            self._count('applied', n_events)
+            self._count('coalesced', len(batch) - n_events)
+            if self.activity_log is not None and record:
+                self.activity_log.append([
+                    (user_id, activity_type, course_id)
+                    for user_id, events in activities.items() for activity_type, course_id in events
+                ])
+        except Exception as e:
+            self._count('failed', len(batch))
+            logger.error(f"Failed to apply activity batch of {len(batch)} events: {e}")
+        
+        self._count('batches')
+        self.last_batch_seconds = time.time() - start
+        self.last_batch_at = datetime.now()
+    
+    def _apply_shared(self):
+        """Fold in what other workers recorded; events older than the model's training data are already in it"""
+        try:
+            target = self.get_target()
+            since = target.recommender.training_started_at if target is not None else None
+            shared = self.activity_log.read_new(since)
+        except Exception as e:
+            logger.error(f"Failed to read the shared activity log: {e}")
+            return
+        
+        if shared:
+            self._count('shared', len(shared))
+            self._apply(shared, record=False)
+    
+    def stats(self) -> Dict:
+        """Queue depth, counters and timing of the last batch"""
+        with self._stats_lock:
+            counters = dict(self.counters)
+        
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            **counters,
+            'last_batch_seconds': self.last_batch_seconds,
+            'last_batch_at': self.last_batch_at.isoformat() if self.last_batch_at else None
+        }
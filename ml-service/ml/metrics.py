@@ -0,0 +1,344 @@
+"""
+Metrics for the Course Recommendation System
+Counters, gauges and histograms rendered in the Prometheus text exposition format, optionally
+merged across the processes of the prefork server
+"""
+
+import os
+import json
+import math
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRAINING_BUCKETS = (10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0, 7200.0)
+
+logger = logging.getLogger(__name__)
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class Metric:
+    """A named metric family with a fixed set of label names.
+
+    Unlabelled counters and gauges can instead read their value from a callback at
+    render time, for numbers another component already keeps (cache hits, queue depth).
+    """
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._function: Optional[Callable[[], Optional[float]]] = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function: Callable[[], Optional[float]]):
+        """Read the value from function at render time; None omits the sample"""
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels and cannot use a callback")
+        self._function = function
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """(sample name, labels, value) triples"""
+        if self._function is not None:
+            value = self._function()
+            return [] if value is None else [(self.name, {}, float(value))]
+
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in values]
+
+    def render(self, samples: List[Tuple[str, Dict[str, str], float]] = None) -> str:
+        """The family with its own samples, or with samples merged from several processes"""
+        if samples is None:
+            samples = self.samples()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples)
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    """Value that can go up and down.
+
+    multiprocess_mode says how values from several live processes combine: 'sum' adds
+    them up, 'all' keeps one sample per process under a pid label.
+    """
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 multiprocess_mode: str = 'all'):
+        if multiprocess_mode not in ('all', 'sum'):
+            raise ValueError(f"Unknown multiprocess_mode {multiprocess_mode!r} for {name}")
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the last one for +Inf, then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall time spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(key, list(state)) for key, state in self._values.items()]
+
+        samples = []
+        for key, state in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, state[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class Registry:
+    """The metric families one process exposes"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Every family in the text exposition format"""
+        return '\n'.join(metric.render() for metric in self.metrics()) + '\n'
+
+    def snapshot(self) -> Dict[str, List]:
+        """Every family's current samples, keyed by family name"""
+        return {metric.name: [list(sample) for sample in metric.samples()] for metric in self.metrics()}
+
+REGISTRY = Registry()
+
+# Multi-process mode. Under serving.py a scrape reaches one arbitrary worker, so each
+# process writes its samples to <directory>/<pid>.json and the scraped one merges every
+# file. Counters and histograms are summed, and when a process exits the master folds
+# them into dead.json so totals never go backwards; gauges come from live processes only.
+_multiprocess_directory: Optional[str] = None
+_DEAD_FILE = 'dead.json'
+_dead_lock = threading.Lock()
+
+def _write_json(path: str, data: Dict):
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def reset_multiprocess_directory(directory: str):
+    """Drop samples left by an earlier run; called by the master before any process starts"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            os.remove(os.path.join(directory, name))
+
+def flush():
+    """Write this process's samples to the shared directory"""
+    if _multiprocess_directory is not None:
+        _write_json(os.path.join(_multiprocess_directory, f"{os.getpid()}.json"), REGISTRY.snapshot())
+
+def _flush_periodically(interval_seconds: float):
+    while True:
+        time.sleep(interval_seconds)
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Error writing metrics for process {os.getpid()}: {e}")
+
+def enable_multiprocess(directory: str, flush_seconds: float):
+    """Share this process's samples through directory, rewritten every flush_seconds and at exit"""
+    global _multiprocess_directory
+
+    os.makedirs(directory, exist_ok=True)
+    _multiprocess_directory = directory
+    flush()
+    atexit.register(flush)
+    threading.Thread(target=_flush_periodically, args=(flush_seconds,), name='metrics-flusher', daemon=True).start()
+
+def mark_process_dead(directory: str, pid: int):
+    """Fold an exited process's counters and histograms into dead.json and drop its gauges.
+
+    Only the master calls this; the lock serializes its main thread and the trainer watcher,
+    so dead.json has a single writer.
+    """
+    with _dead_lock:
+        _fold_dead_process(directory, pid)
+
+def _fold_dead_process(directory: str, pid: int):
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+
+    dead_path = os.path.join(directory, _DEAD_FILE)
+    dead = _read_json(dead_path) or {}
+    for metric in REGISTRY.metrics():
+        if isinstance(metric, Gauge):
+            continue
+        sources = [(None, dead.get(metric.name, [])), (None, snapshot.get(metric.name, []))]
+        dead[metric.name] = [list(sample) for sample in _merge_samples(metric, sources)]
+    _write_json(dead_path, dead)
+    os.remove(path)
+
+def _merge_samples(metric: Metric, sources: List[Tuple[Optional[str], List]]) -> List[Tuple[str, Dict[str, str], float]]:
+    """Sum samples with the same name and labels; gauges in 'all' mode are kept apart by a pid label"""
+    totals: Dict[Tuple, float] = {}
+    for pid, samples in sources:
+        for name, labels, value in samples:
+            if isinstance(metric, Gauge) and metric.multiprocess_mode == 'all':
+                labels = {**labels, 'pid': pid}
+            key = (name, tuple(labels.items()))
+            totals[key] = totals.get(key, 0.0) + value
+    return [(name, dict(labels), value) for (name, labels), value in totals.items()]
+
+def render() -> str:
+    """Every family in the text exposition format, merged across processes in multi-process mode"""
+    if _multiprocess_directory is None:
+        return REGISTRY.render()
+
+    # Flush first, so everything this scrape reports is on disk and a later exit cannot take it back
+    flush()
+    live, dead = [], None
+    for name in sorted(os.listdir(_multiprocess_directory)):
+        if not name.endswith('.json'):
+            continue
+        snapshot = _read_json(os.path.join(_multiprocess_directory, name))
+        if snapshot is None:
+            continue
+        if name == _DEAD_FILE:
+            dead = snapshot
+        else:
+            live.append((name[:-len('.json')], snapshot))
+
+    families = []
+    for metric in REGISTRY.metrics():
+        sources = [(pid, snapshot.get(metric.name, [])) for pid, snapshot in live]
+        if dead is not None and not isinstance(metric, Gauge):
+            sources.append((None, dead.get(metric.name, [])))
+        families.append(metric.render(_merge_samples(metric, sources)))
+    return '\n'.join(families) + '\n'
+
+# Request path
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'recommender_http_request_duration_seconds', 'API request latency by route',
+    ('method', 'route', 'status')
+))
+RECOMMENDATION_STAGE_SECONDS = REGISTRY.register(Histogram(
+    'recommender_recommendation_stage_duration_seconds', 'Time spent in each stage of computing recommendations',
+    ('stage',)
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'recommender_db_query_duration_seconds', 'Database time per query; streamed queries count execute and fetch time only',
+    ('kind',)
+))
+
+# Training and the served model
+TRAINING_SECONDS = REGISTRY.register(Histogram(
+    'recommender_training_duration_seconds', 'Duration of training runs in this process',
+    buckets=TRAINING_BUCKETS
+))
+MODEL_TRAINING_SECONDS = REGISTRY.register(Gauge(
+    'recommender_model_training_duration_seconds', 'How long the served model took to train'
+))
+MODEL_SIZE_BYTES = REGISTRY.register(Gauge(
+    'recommender_model_size_bytes', 'On-disk size of the served model artifact version'
+))
+MODEL_PUBLISHED_TIMESTAMP = REGISTRY.register(Gauge(
+    'recommender_model_published_timestamp_seconds', 'When this process started serving its current model'
+))
+
+# Response cache and admission control
+CACHE_HITS = REGISTRY.register(Counter('recommender_cache_hits_total', 'Response cache hits'))
+CACHE_MISSES = REGISTRY.register(Counter('recommender_cache_misses_total', 'Response cache misses, expired entries included'))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge('recommender_cache_hit_ratio', 'Response cache hits over lookups since the process started'))
+CACHE_ENTRIES = REGISTRY.register(Gauge('recommender_cache_entries', 'Lists held in the response cache', multiprocess_mode='sum'))
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge('recommender_admission_in_flight', 'Scoring requests running', multiprocess_mode='sum'))
+ADMISSION_QUEUED = REGISTRY.register(Gauge('recommender_admission_queued', 'Scoring requests waiting for a slot', multiprocess_mode='sum'))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'recommender_admission_rejected_total', 'Scoring requests refused because the queue was full or the wait timed out'
+))
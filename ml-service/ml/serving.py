@@ -0,0 +1,159 @@
+"""
+Prefork serving for the Course Recommendation System
+Runs the API in several gunicorn worker processes sharing one memory-mapped model, next to a single training process
+"""
+
+import os
+import sys
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+import time
+
+from gunicorn.app.base import BaseApplication
+
+# Add current directory to path to import local modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from config import API_CONFIG, SERVING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def run_trainer():
+    """Entry point of the training process: snapshot syncs, scheduled and requested retrains"""
+    import app as api
+    
+    # Turn SIGTERM into a normal exit so the app's cleanup runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    if not api.initialize_trainer():
+        sys.exit(1)
+    
+    api.setup_scheduler()
+    api.scheduler_thread.join()
+
+class PreforkServer(BaseApplication):
+    """gunicorn master with N API workers and one training process.
+    
+    Workers load the app after forking and memory-map the current model artifact, so
+    the arrays are shared through the page cache instead of copied per worker; only the
+    per-worker index dicts are private. The training process is a fresh interpreter
+    running this module with --trainer, so it inherits nothing from the master, and it
+    publishes new artifact versions that the workers pick up on their own. Every process
+    writes its metrics to a shared directory, and the master folds in those of processes
+    that exit, so /metrics on any worker reports totals for the whole server. A thread in
+    the master restarts the training process whenever it dies, backing off while it keeps
+    crashing, so scheduled retrains and snapshot syncs never stop silently.
+    """
+    
+    def __init__(self, workers: int = None, bind: str = None):
+        self.options = {
+            'bind': bind or f"{API_CONFIG['host']}:{API_CONFIG['port']}",
+            'workers': workers or SERVING_CONFIG['workers'],
+            'threads': SERVING_CONFIG['threads_per_worker'],
+            'timeout': SERVING_CONFIG['worker_timeout_seconds'],
+            'preload_app': False,  # Nothing is loaded in the master, so workers share only the artifact files
+            'on_starting': self.start_trainer,
+            'post_worker_init': self.init_worker,
+            'child_exit': self.worker_exited,
+            'on_exit': self.stop_trainer
+        }
+        self.trainer = None
+        self.trainer_started_at = None
+        self._trainer_lock = threading.Lock()
+        self._stopping = threading.Event()
+        super().__init__()
+    
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+    
+    def load(self):
+        import app as api
+        return api.app
+    
+    def start_trainer(self, server):
+        """Start the training process before any worker is forked, and keep it running"""
+        metrics.reset_multiprocess_directory(SERVING_CONFIG['metrics_dir'])
+        self._spawn_trainer(server)
+        threading.Thread(target=self.watch_trainer, args=(server,), name='trainer-watcher', daemon=True).start()
+    
+    def _spawn_trainer(self, server):
+        with self._trainer_lock:
+            # Checked under the lock, so stop_trainer never misses a process started during shutdown
+            if self._stopping.is_set():
+                return
+            self.trainer = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--trainer'])
+            self.trainer_started_at = time.monotonic()
+        server.log.info(f"Training process started (pid {self.trainer.pid})")
+    
+    def watch_trainer(self, server):
+        """Restart the training process when it exits; the delay doubles while it keeps dying soon after starting"""
+        min_delay = SERVING_CONFIG['trainer_poll_seconds']
+        max_delay = SERVING_CONFIG['trainer_restart_max_seconds']
+        delay = min_delay
+        while not self._stopping.wait(SERVING_CONFIG['trainer_poll_seconds']):
+            with self._trainer_lock:
+                code = self.trainer.poll()
+                if code is None or self._stopping.is_set():
+                    continue
+                pid, ran_seconds = self.trainer.pid, time.monotonic() - self.trainer_started_at
+            
+            metrics.mark_process_dead(SERVING_CONFIG['metrics_dir'], pid)
+            if ran_seconds > max_delay:
+                delay = min_delay
+            server.log.error(f"Training process {pid} exited with code {code} after {ran_seconds:.0f}s, restarting in {delay}s")
+            if self._stopping.wait(delay):
+                return
+            self._spawn_trainer(server)
+            delay = min(delay * 2, max_delay)
+    
+    @staticmethod
+    def init_worker(worker):
+        import app as api
+        if not api.initialize_worker():
+            # Exit code 1 makes the master replace the worker instead of keeping one that only answers 503;
+            # gunicorn treats code 3 as a boot error and would halt the whole server. Waiting first keeps
+            # workers from respawning in a tight loop while the database is unreachable.
+            delay = SERVING_CONFIG['worker_init_retry_seconds']
+            worker.log.error(f"Serving worker failed to initialize, exiting in {delay}s")
+            time.sleep(delay)
+            sys.exit(1)
+    
+    @staticmethod
+    def worker_exited(server, worker):
+        metrics.mark_process_dead(SERVING_CONFIG['metrics_dir'], worker.pid)
+    
+    def stop_trainer(self, server):
+        self._stopping.set()
+        with self._trainer_lock:
+            pass  # Wait out a restart in progress; none can start after this
+        if self.trainer is not None and self.trainer.poll() is None:
+            self.trainer.terminate()
+            try:
+                self.trainer.wait(30)
+            except subprocess.TimeoutExpired:
+                server.log.warning("Training process did not stop within 30s, killing it")
+                self.trainer.kill()
+                self.trainer.wait()
+            server.log.info("Training process stopped")
+        if self.trainer is not None:
+            metrics.mark_process_dead(SERVING_CONFIG['metrics_dir'], self.trainer.pid)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the recommendation API with prefork workers')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--bind', help='Address to listen on, host:port')
+    parser.add_argument('--trainer', action='store_true', help='Run the training process (started by the server itself)')
+    args = parser.parse_args()
+    
+    if args.trainer:
+        run_trainer()
+    else:
+        PreforkServer(args.workers, args.bind).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+"""
+Training data sources for the Course Recommendation System
+A local columnar snapshot refreshed with watermark-based delta queries, and a per-run context that fetches each dataset once
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import SNAPSHOT_CONFIG, TRAINING_CONFIG, FEATURE_CONFIG
+from core import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Each dataset is fetched with its query; rows where any of changed_columns is at or after the last
+# sync's watermark are upserted by key. The delta predicate compares those raw timestamp columns
+# one by one (OR'ed) so MySQL can use their indexes, while synced_at, the newest of them, is only
+# computed for fetched rows. Filters that depend on other tables are applied when reading.
+# Columns that change without moving any timestamp (refresh_columns) are re-read for every row
+# with the narrow refresh_query on each delta sync; rows it no longer returns are dropped.
+# Aggregated datasets re-fetch whole day buckets (whole_days) and only keep window_days of history.
+DATASETS = {
+    'interactions': {
+        'query': """
+        SELECT
+            e.student_id,
+            e.course_id,
+            e.completion_status,
+            e.progress,
+            e.enrollment_date,
+            e.completion_date,
+            GREATEST(e.enrollment_date, COALESCE(e.completion_date, e.enrollment_date)) as synced_at
+        FROM enrollments e
+        {where}
+        """,
+        'changed_columns': ['e.enrollment_date', 'e.completion_date'],
+        # Status and progress are updated in place, and enrollments have no updated_at
+        'refresh_query': """
+        SELECT e.student_id, e.course_id, e.completion_status, e.progress
+        FROM enrollments e
+        """,
+        'refresh_columns': ['completion_status', 'progress'],
+        'key': ['student_id', 'course_id'],
+        'dtypes': {'student_id': 'int64', 'course_id': 'int64', 'completion_status': 'object',
+                   'progress': 'float64', 'enrollment_date': 'datetime64[ns]', 'completion_date': 'datetime64[ns]',
+                   'synced_at': 'datetime64[ns]'}
+    },
+    'quiz_attempts': {
+        'query': """
+        SELECT
+            qa.id as attempt_id,
+            qa.student_id,
+            q.course_id,
+            qa.score,
+            qa.is_passing,
+            GREATEST(qa.end_time, COALESCE(qa.updated_at, qa.end_time)) as synced_at
+        FROM quiz_attempts qa
+        JOIN quizzes q ON qa.quiz_id = q.id
+        WHERE qa.end_time IS NOT NULL {and_where}
+        """,
+        'changed_columns': ['qa.end_time', 'qa.updated_at'],
+        'key': ['attempt_id'],
+        'dtypes': {'attempt_id': 'int64', 'student_id': 'int64', 'course_id': 'int64', 'score': 'float64',
+                   'is_passing': 'bool', 'synced_at': 'datetime64[ns]'}
+    },
+    'assignment_submissions': {
+        'query': """
+        SELECT
+            asub.id as submission_id,
+            asub.student_id,
+            a.course_id,
+            asub.grade,
+            asub.is_late,
+            GREATEST(asub.submission_date, COALESCE(asub.updated_at, asub.submission_date)) as synced_at
+        FROM assignment_submissions asub
+        JOIN assignments a ON asub.assignment_id = a.id
+        WHERE asub.grade IS NOT NULL {and_where}
+        """,
+        'changed_columns': ['asub.submission_date', 'asub.updated_at'],
+        'key': ['submission_id'],
+        'dtypes': {'submission_id': 'int64', 'student_id': 'int64', 'course_id': 'int64', 'grade': 'float64',
+                   'is_late': 'bool', 'synced_at': 'datetime64[ns]'}
+    },
+    'activity_days': {
+        'query': """
+        SELECT
+            ua.user_id,
+            ua.type,
+            DATE(ua.created_at) as day,
+            COUNT(*) as events,
+            MAX(ua.created_at) as synced_at
+        FROM user_activities ua
+        {where}
+        GROUP BY ua.user_id, ua.type, DATE(ua.created_at)
+        """,
+        'changed_columns': ['ua.created_at'],
+        'key': ['user_id', 'type', 'day'],
+        'dtypes': {'user_id': 'int64', 'type': 'object', 'day': 'datetime64[ns]', 'events': 'int64',
+                   'synced_at': 'datetime64[ns]'},
+        'whole_days': True,
+        'window_days': FEATURE_CONFIG['max_days_lookback']
+    }
+}
+
+class TrainingSnapshot:
+    """Columnar on-disk copy of the training tables, kept current with delta fetches.
+    
+    Exposes the streaming iter_* methods training reads from and get_enrollments_data,
+    served from local files; every other attribute is delegated to the wrapped DatabaseManager, so a snapshot can
+    be handed to HybridRecommender in place of the database.
+    """
+    
+    def __init__(self, db_manager: DatabaseManager, directory: str = None):
+        self.db = db_manager
+        self.directory = directory or SNAPSHOT_CONFIG['path']
+        self.full_reload_interval = timedelta(hours=SNAPSHOT_CONFIG['full_reload_hours'])
+        self.overlap = timedelta(minutes=SNAPSHOT_CONFIG['watermark_overlap_minutes'])
+        self._lock = threading.RLock()  # Serializes syncs, and file swaps against readers opening a dataset
+    
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+    
+    def sync(self) -> Dict[str, Dict]:
+        """Bring every dataset up to date; returns per-dataset sync statistics"""
+        with self._lock:
+            return {name: self._sync_dataset(name, spec) for name, spec in DATASETS.items()}
+    
+    def _sync_dataset(self, name: str, spec: Dict) -> Dict:
+        """Full reload when due or missing, otherwise fetch rows newer than the watermark and upsert them"""
+        started = datetime.now()
+        meta = self._read_meta(name)
+        full = (
+            meta is None
+            or meta['columns'] != list(spec['dtypes'])  # The dataset's query gained or lost columns
+            or started - datetime.fromisoformat(meta['last_full_sync']) > self.full_reload_interval
+        )
+        cutoff = None
+        if spec.get('window_days'):
+            cutoff = datetime.combine((started - timedelta(days=spec['window_days'])).date(), datetime.min.time())
+        
+        refreshed = False
+        if full:
+            table = self._fetch(spec, cutoff)
+            fetched = len(table)
+            pruned = 0
+        else:
+            # Re-read a short overlap so rows committed late with older timestamps are not missed
+            since = datetime.fromisoformat(meta['watermark']) - self.overlap if meta['watermark'] else None
+            if since is not None and spec.get('whole_days'):
+                # Day buckets are re-aggregated from their first event, so the fetched ones replace stored ones whole
+                since = datetime.combine(since.date(), datetime.min.time())
+            if cutoff is not None:
+                since = max(since, cutoff) if since is not None else cutoff
+            delta = self._fetch(spec, since)
+            fetched = len(delta)
+            table = self._read_table(name)
+            if fetched:
+                table = pd.concat([table, delta], ignore_index=True).drop_duplicates(spec['key'], keep='last')
+            
+            rows = len(table)
+            if cutoff is not None:
+                table = table[table['day'] >= cutoff].reset_index(drop=True)
+            pruned = rows - len(table)
+            
+            if spec.get('refresh_query'):
+                current = self._refresh_columns(spec, table)
+                refreshed = not current.equals(table)
+                table = current
+        
+        if full or fetched or pruned or refreshed:
+            watermark = table['synced_at'].max() if len(table) else None
+            self._write_table(name, table, {
+                'watermark': watermark.isoformat() if watermark is not None and pd.notna(watermark) else None,
+                'last_full_sync': started.isoformat() if full else meta['last_full_sync'],
+                'last_sync': started.isoformat(),
+                'rows': len(table)
+            })
+        
+        stats = {'full': full, 'fetched_rows': fetched, 'refreshed': refreshed, 'rows': len(table), 'seconds': (datetime.now() - started).total_seconds()}
+        logger.info(f"Snapshot {name}: {'full reload' if full else 'delta'} of {fetched} rows{', columns refreshed' if refreshed else ''}, {len(table)} total")
+        return stats
+    
+    def _fetch(self, spec: Dict, since: Optional[datetime] = None) -> pd.DataFrame:
+        """Run a dataset query, restricted to rows changed at or after `since` when given"""
+        params = None
+        where = and_where = ''
+        if since is not None:
+            changed = ' OR '.join(f"{column} >= %s" for column in spec['changed_columns'])
+            where = f"WHERE ({changed})"
+            and_where = f"AND ({changed})"
+            params = (since,) * len(spec['changed_columns'])
+        
+        query = spec['query'].format(where=where, and_where=and_where)
+        chunks = list(self.db.execute_query_chunks(query, params, spec['dtypes']))
+        if not chunks:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in spec['dtypes'].items()})
+        return pd.concat(chunks, ignore_index=True)
+    
+    def _refresh_columns(self, spec: Dict, table: pd.DataFrame) -> pd.DataFrame:
+        """Overwrite refresh_columns with their current values, dropping rows deleted upstream"""
+        columns = spec['key'] + spec['refresh_columns']
+        dtypes = {column: spec['dtypes'][column] for column in columns}
+        chunks = list(self.db.execute_query_chunks(spec['refresh_query'], dtypes=dtypes))
+        if chunks:
+            current = pd.concat(chunks, ignore_index=True)
+        else:
+            current = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+        
+        # An inner merge keeps the stored row order, so an unchanged table compares equal
+        return table.drop(columns=spec['refresh_columns']).merge(current, on=spec['key'], how='inner')[list(table.columns)]
+    
+    def _dataset_dir(self, name: str) -> str:
+        """Directory of a dataset, falling back to the previous copy if a swap was interrupted"""
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(path) and os.path.isdir(path + '.old'):
+            return path + '.old'
+        return path
+    
+    def _read_meta(self, name: str) -> Optional[Dict]:
+        path = os.path.join(self._dataset_dir(name), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+    
+    def _write_table(self, name: str, table: pd.DataFrame, meta: Dict):
+        """Write one .npy file per column into a fresh directory, then swap it in"""
+        path = os.path.join(self.directory, name)
+        tmp_path, old_path = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        
+        # Strings are dictionary-encoded so no column needs pickling
+        categories = {}
+        for column in table.columns:
+            values = table[column]
+            if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+                codes, uniques = pd.factorize(values, sort=True)
+                categories[column] = uniques.tolist()
+                array = codes.astype(np.int32)
+            else:
+                array = values.to_numpy()
+            np.save(os.path.join(tmp_path, f"{column}.npy"), array, allow_pickle=False)
+        
+        meta = dict(meta, columns=list(table.columns), categories=categories)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    
+    def _open_columns(self, name: str) -> Tuple[Optional[Dict], Dict]:
+        """Memory-map every column of a dataset; string columns are returned with their categories"""
+        with self._lock:
+            path = self._dataset_dir(name)
+            meta = self._read_meta(name)
+            if meta is None:
+                return None, {}
+            columns = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r') for column in meta['columns']}
+        
+        for column, uniques in meta['categories'].items():
+            columns[column] = (columns[column], np.array(uniques + [None], dtype=object))
+        return meta, columns
+    
+    def _read_table(self, name: str) -> pd.DataFrame:
+        """Load a whole dataset into memory (used when merging a delta)"""
+        return pd.concat(list(self._iter_dataset(name)), ignore_index=True)
+    
+    def _iter_dataset(self, name: str, chunk_size: int = None, mask=None) -> Iterator[pd.DataFrame]:
+        """Yield a dataset in row chunks built from the memory-mapped columns"""
+        meta, columns = self._open_columns(name)
+        if meta is None:
+            logger.warning(f"Snapshot {name} has not been synced yet")
+            return
+        
+        chunk_size = chunk_size or TRAINING_CONFIG['query_chunk_rows']
+        # Always yield at least one (possibly empty) chunk so callers keep the column layout
+        for start in range(0, max(meta['rows'], 1), chunk_size):
+            chunk = {}
+            for column, values in columns.items():
+                if isinstance(values, tuple):
+                    codes, uniques = values
+                    # Code -1 (missing) picks the trailing None
+                    chunk[column] = uniques[np.asarray(codes[start:start + chunk_size])]
+                else:
+                    chunk[column] = np.asarray(values[start:start + chunk_size])
+            chunk = pd.DataFrame(chunk)
+            if mask is not None:
+                chunk = chunk[mask(chunk)].reset_index(drop=True)
+            yield chunk
+    
+    def _published_course_mask(self):
+        """Row filter keeping courses that are published right now"""
+        published = self.db.execute_query("SELECT id FROM courses WHERE status = 'published'")
+        published_ids = published['id'].values
+        return lambda chunk: np.isin(chunk['course_id'].values, published_ids)
+    
+    def iter_interactions(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream (student, course, status, progress) rows of published courses from the snapshot"""
+        mask = self._published_course_mask()
+        for chunk in self._iter_dataset('interactions', chunk_size, mask):
+            yield chunk[['student_id', 'course_id', 'completion_status', 'progress']]
+    
+    def get_enrollments_data(self) -> pd.DataFrame:
+        """Enrollments of published courses with their course columns, as DatabaseManager returns them.
+        
+        Enrollment rows come from the snapshot; only the courses table, which does not grow
+        with the enrollment history, is queried.
+        """
+        if self._read_meta('interactions') is None:
+            logger.warning("Snapshot interactions has not been synced yet, reading enrollments from the database")
+            return self.db.get_enrollments_data()
+        
+        courses = self.db.execute_query("""
+        SELECT
+            c.id as course_id,
+            c.title as course_title,
+            c.description as course_description,
+            c.instructor_id,
+            c.department_id,
+            c.status as course_status,
+            d.name as department_name
+        FROM courses c
+        LEFT JOIN departments d ON c.department_id = d.id
+        WHERE c.status = 'published'
+        """)
+        
+        published_ids = courses['course_id'].values
+        mask = lambda chunk: np.isin(chunk['course_id'].values, published_ids)
+        enrollment_columns = ['student_id', 'course_id', 'completion_status', 'enrollment_date', 'completion_date', 'progress']
+        enrollments = pd.concat(
+            [chunk[enrollment_columns] for chunk in self._iter_dataset('interactions', mask=mask)], ignore_index=True
+        )
+        return enrollments.merge(courses, on='course_id', how='inner')[
+            enrollment_columns + ['course_title', 'course_description', 'instructor_id', 'department_id',
+                                  'course_status', 'department_name']
+        ]
+    
+    def iter_quiz_attempts(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream finished quiz attempts from the snapshot"""
+        for chunk in self._iter_dataset('quiz_attempts', chunk_size):
+            yield chunk[['student_id', 'course_id', 'score', 'is_passing']]
+    
+    def iter_assignment_submissions(self, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream graded assignment submissions from the snapshot"""
+        for chunk in self._iter_dataset('assignment_submissions', chunk_size):
+            yield chunk[['student_id', 'course_id', 'grade', 'is_late']]
+    
+    def iter_activity_days(self, days_back: int = 90, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """Stream per-day activity counts over the last days_back whole days from the snapshot"""
+        cutoff = pd.Timestamp((datetime.now() - timedelta(days=days_back)).date())
+        mask = lambda chunk: chunk['day'] >= cutoff
+        for chunk in self._iter_dataset('activity_days', chunk_size, mask):
+            yield chunk[['user_id', 'type', 'day', 'events']]
+    
+    def stats(self) -> Dict[str, Optional[Dict]]:
+        """Watermark, row count and sync times of every dataset"""
+        return {name: self._read_meta(name) for name in DATASETS}
+
+class TrainingDataContext:
+    """Fetches each training dataset once per training run and shares it across stages.
+    
+    The availability check, model training and evaluation all read enrollments, course
+    features and students; inside one run they get the same frames instead of re-running
+    the queries. Callers receive shallow copies, so adding or reassigning columns never
+    leaks into another stage. Everything else is delegated to the wrapped source; after
+    close() the memoized frames are released and reads go straight to the source again,
+    so a model that keeps a reference to the context does not pin them.
+    """
+    
+    MEMOIZED = ('get_enrollments_data', 'get_course_features', 'get_students')
+    
+    def __init__(self, source):
+        self.source = source
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.reads = 0
+    
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def get_enrollments_data(self) -> pd.DataFrame:
+        return self._memoized('get_enrollments_data')
+    
+    def get_course_features(self) -> pd.DataFrame:
+        return self._memoized('get_course_features')
+    
+    def get_students(self) -> pd.DataFrame:
+        return self._memoized('get_students')
+    
+    def _memoized(self, name: str) -> pd.DataFrame:
+        """Fetch a dataset on first use and hand out shallow copies afterwards"""
+        with self._lock:
+            if self._closed:
+                return getattr(self.source, name)()
+            
+            self.reads += 1
+            if name not in self._frames:
+                self._frames[name] = getattr(self.source, name)()
+            return self._frames[name].copy(deep=False)
+    
+    def close(self):
+        """Release the memoized frames"""
+        with self._lock:
+            if not self._closed:
+                logger.info(f"Training data context served {self.reads} reads with {len(self._frames)} queries")
+            self._frames.clear()
+            self._closed = True
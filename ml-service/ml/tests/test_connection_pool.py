@@ -0,0 +1,74 @@
+"""
+Connection pool of DatabaseManager: connections that die mid-query must not be reused
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pymysql
+import pytest
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from core import DatabaseManager
+
+class FakeConnection:
+    """Stands in for a pymysql connection; open goes False when the server drops it"""
+
+    def __init__(self):
+        self.open = True
+
+    def ping(self, reconnect: bool = False):
+        if not self.open:
+            raise pymysql.err.InterfaceError(0, '')
+
+    def close(self):
+        self.open = False
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(pymysql, 'connect', lambda **kwargs: FakeConnection())
+    return DatabaseManager()
+
+def test_connection_killed_during_pandas_query_is_replaced(db):
+    with pytest.raises(pd.errors.DatabaseError):
+        with db.checkout() as connection:
+            killed = connection
+            killed.open = False
+            # What pd.read_sql raises when the server goes away during a query
+            try:
+                raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+            except pymysql.err.OperationalError as e:
+                raise pd.errors.DatabaseError("Execution failed on sql") from e
+
+    with db.checkout() as connection:
+        assert connection is not killed
+        assert connection.open
+    assert db.get_pool_stats()['connections_discarded'] == 1
+
+def test_wrapped_driver_error_marks_connection_broken(db):
+    with pytest.raises(pd.errors.DatabaseError):
+        with db.checkout() as connection:
+            suspect = connection
+            try:
+                raise pymysql.err.InterfaceError(0, '')
+            except pymysql.err.InterfaceError as e:
+                raise pd.errors.DatabaseError("Execution failed on sql") from e
+
+    with db.checkout() as connection:
+        assert connection is not suspect
+
+def test_query_errors_keep_the_connection(db):
+    with pytest.raises(pd.errors.DatabaseError):
+        with db.checkout() as connection:
+            healthy = connection
+            try:
+                raise pymysql.err.ProgrammingError(1064, 'You have an error in your SQL syntax')
+            except pymysql.err.ProgrammingError as e:
+                raise pd.errors.DatabaseError("Execution failed on sql") from e
+
+    with db.checkout() as connection:
+        assert connection is healthy
+    assert db.get_pool_stats()['connections_discarded'] == 0
@@ -0,0 +1,50 @@
+"""
+The enrollment index is read off the collaborative filter's matrix instead of a second interaction scan
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from core import CollaborativeFilter, ContentBasedFilter
+
+class CountingInteractions:
+    """Serves a fixed interaction table and counts how often it is streamed"""
+
+    def __init__(self, interactions: pd.DataFrame):
+        self.interactions = interactions
+        self.scans = 0
+
+    def iter_interactions(self, chunk_size: int = None):
+        self.scans += 1
+        for start in range(0, len(self.interactions), 3):
+            yield self.interactions.iloc[start:start + 3].reset_index(drop=True)
+
+def make_source() -> CountingInteractions:
+    return CountingInteractions(pd.DataFrame({
+        'student_id': [1, 1, 2, 3, 3, 3, 1],
+        'course_id': [10, 11, 10, 12, 10, 11, 10],
+        'completion_status': ['completed', 'in_progress', 'not_started', 'in_progress', 'completed', 'not_started', 'completed'],
+        'progress': [100.0, 40.0, 0.0, np.nan, 100.0, 0.0, 100.0]
+    }))
+
+def test_index_from_matrix_matches_streamed_index():
+    source = make_source()
+    collaborative_filter = CollaborativeFilter(source)
+    collaborative_filter.build_user_item_matrix()
+
+    from_matrix = ContentBasedFilter(source)
+    from_matrix.build_enrollment_index(collaborative_filter)
+    assert source.scans == 1
+
+    streamed = ContentBasedFilter(source)
+    streamed.build_enrollment_index()
+
+    assert set(from_matrix.user_courses) == set(streamed.user_courses)
+    for user_id, course_ids in streamed.user_courses.items():
+        assert sorted(from_matrix.user_courses[user_id].tolist()) == sorted(course_ids.tolist())
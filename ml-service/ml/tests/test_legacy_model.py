@@ -0,0 +1,89 @@
+"""
+Loading the model pickled by older releases (ml/model.pkl)
+"""
+
+import os
+import sys
+import pickle
+
+import pandas as pd
+import pytest
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from core import HybridRecommender
+
+LEGACY_MODEL_PATH = os.path.join(ML_DIR, 'ml', 'model.pkl')
+
+class LegacyDataSource:
+    """Serves the courses and enrollments stored in the legacy pickle in place of MySQL"""
+
+    def __init__(self, model_data):
+        content_filter = model_data['content_filter']
+        self.courses = content_filter.course_features.drop(columns=['text_features'])
+
+        matrix = model_data['collaborative_filter'].user_item_matrix
+        pairs = matrix.stack()
+        pairs = pairs[pairs > 0].reset_index()
+        pairs.columns = ['student_id', 'course_id', 'score']
+        self.enrollments = pd.DataFrame({
+            'student_id': pairs['student_id'].astype('int64'),
+            'course_id': pairs['course_id'].astype('int64'),
+            'completion_status': 'in_progress',
+            'progress': 0.0
+        })
+
+    def get_course_features(self) -> pd.DataFrame:
+        return self.courses.copy()
+
+    def get_enrollments_data(self) -> pd.DataFrame:
+        return self.enrollments.copy()
+
+    def iter_interactions(self, chunk_size: int = None):
+        yield self.enrollments.copy()
+
+@pytest.fixture(scope='module')
+def legacy_model_data():
+    with open(LEGACY_MODEL_PATH, 'rb') as f:
+        return pickle.load(f)
+
+@pytest.fixture(scope='module')
+def loaded(legacy_model_data):
+    return HybridRecommender.load_model(LEGACY_MODEL_PATH, LegacyDataSource(legacy_model_data))
+
+def test_legacy_pickle_loads(loaded, legacy_model_data):
+    assert loaded is not None
+    assert loaded.is_trained
+
+    frame = legacy_model_data['collaborative_filter'].user_item_matrix
+    cf = loaded.collaborative_filter
+    assert cf.is_fitted()
+    assert cf.user_item_matrix.shape == frame.shape
+    assert set(cf.user_index) == set(int(user_id) for user_id in frame.index)
+
+def test_legacy_matrix_values_are_kept(loaded, legacy_model_data):
+    frame = legacy_model_data['collaborative_filter'].user_item_matrix
+    cf = loaded.collaborative_filter
+    user_id, course_id = int(frame.index[0]), int(frame.columns[0])
+
+    assert cf.user_item_matrix[cf.user_index[user_id], cf.course_index[course_id]] == pytest.approx(frame.loc[user_id, course_id])
+
+def test_legacy_model_serves_recommendations(loaded, legacy_model_data):
+    user_id = int(legacy_model_data['collaborative_filter'].user_item_matrix.index[0])
+    enrolled = set(loaded.content_filter.user_courses[user_id].tolist())
+
+    recommendations = loaded.get_recommendations(user_id, 3)
+    assert recommendations
+    assert not enrolled & {recommendation['course_id'] for recommendation in recommendations}
+
+    loaded.materialized = None
+    assert loaded.get_recommendations(user_id, 3)
+
+def test_legacy_model_converts_to_artifact(loaded, legacy_model_data, tmp_path):
+    loaded.save_model(str(tmp_path))
+    reloaded = HybridRecommender.load_model(str(tmp_path), LegacyDataSource(legacy_model_data))
+
+    user_id = int(legacy_model_data['collaborative_filter'].user_item_matrix.index[0])
+    assert reloaded is not None
+    assert reloaded.get_recommendations(user_id, 3) == loaded.get_recommendations(user_id, 3)
@@ -0,0 +1,71 @@
+"""
+Delta syncs of the training snapshot against an in-memory SQLite copy of the enrollments table
+"""
+
+import os
+import sys
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from core import DatabaseManager
+from snapshot import DATASETS, TrainingSnapshot
+
+class SQLiteSource:
+    """Answers the snapshot's MySQL queries from SQLite"""
+
+    def __init__(self):
+        self.connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        self.connection.create_function('GREATEST', -1, max)
+        self.connection.execute("""
+        CREATE TABLE enrollments (
+            student_id INTEGER, course_id INTEGER, completion_status TEXT, progress REAL,
+            enrollment_date TIMESTAMP, completion_date TIMESTAMP
+        )
+        """)
+
+    def execute(self, query: str, params: tuple = ()):
+        self.connection.execute(query, params)
+
+    def execute_query_chunks(self, query: str, params: tuple = None, dtypes=None, chunk_size: int = None):
+        chunk = pd.read_sql(query.replace('%s', '?'), self.connection, params=[str(p) for p in params or ()])
+        yield DatabaseManager._typed_chunk(chunk, dtypes)
+
+@pytest.fixture
+def source():
+    return SQLiteSource()
+
+def sync_interactions(snapshot: TrainingSnapshot) -> pd.DataFrame:
+    snapshot._sync_dataset('interactions', DATASETS['interactions'])
+    return snapshot._read_table('interactions').set_index(['student_id', 'course_id'])
+
+def test_status_change_without_new_dates_reaches_the_snapshot(source, tmp_path):
+    enrolled = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    recent = (datetime.now() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    source.execute("INSERT INTO enrollments VALUES (1, 10, 'not_started', 0, ?, NULL)", (enrolled,))
+    # A recent enrollment moves the watermark well past the first one
+    source.execute("INSERT INTO enrollments VALUES (2, 10, 'not_started', 0, ?, NULL)", (recent,))
+    snapshot = TrainingSnapshot(source, str(tmp_path))
+    assert sync_interactions(snapshot).loc[(1, 10), 'completion_status'] == 'not_started'
+
+    # Progress is updated in place; neither date column moves, so the delta predicate misses the row
+    source.execute("UPDATE enrollments SET completion_status = 'in_progress', progress = 60 WHERE student_id = 1")
+    table = sync_interactions(snapshot)
+    assert table.loc[(1, 10), 'completion_status'] == 'in_progress'
+    assert table.loc[(1, 10), 'progress'] == 60
+    assert snapshot._read_meta('interactions')['last_full_sync'] != snapshot._read_meta('interactions')['last_sync']
+
+def test_deleted_enrollments_leave_the_snapshot(source, tmp_path):
+    enrolled = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    source.execute("INSERT INTO enrollments VALUES (1, 10, 'in_progress', 20, ?, NULL)", (enrolled,))
+    source.execute("INSERT INTO enrollments VALUES (2, 10, 'in_progress', 40, ?, NULL)", (enrolled,))
+    snapshot = TrainingSnapshot(source, str(tmp_path))
+    sync_interactions(snapshot)
+
+    source.execute("DELETE FROM enrollments WHERE student_id = 2")
+    assert list(sync_interactions(snapshot).index) == [(1, 10)]
@@ -14,8 +14,9 @@ import traceback
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from core import DatabaseManager, HybridRecommender
-from config import TRAINING_CONFIG, LOGGING_CONFIG
+from config import TRAINING_CONFIG, LOGGING_CONFIG, MODEL_CONFIG, SNAPSHOT_CONFIG
 from evaluation import ModelEvaluator
+from snapshot import TrainingSnapshot, TrainingDataContext
 
 def setup_logging():
     """Setup logging configuration"""
@@ -62,45 +63,37 @@ def check_data_availability(db_manager):
         logger.error(f"Error checking data availability: {e}")
         return False
 
-def backup_existing_model():
-    """Backup existing model if it exists"""
-    logger = logging.getLogger(__name__)
-    
-    model_path = TRAINING_CONFIG['model_path']
-    backup_path = TRAINING_CONFIG['backup_model_path']
-    
-    if os.path.exists(model_path):
-        try:
-            if os.path.exists(backup_path):
-                os.remove(backup_path)
-            os.rename(model_path, backup_path)
-            logger.info(f"Existing model backed up to {backup_path}")
-        except Exception as e:
-            logger.warning(f"Could not backup existing model: {e}")
-
 def train_model():
     """Main training function"""
     logger = setup_logging()
     logger.info("Starting course recommendation model training...")
     
     db_manager = None
+    data = None
     try:
         # Initialize database connection
         logger.info("Connecting to database...")
         db_manager = DatabaseManager()
         
+        # Bring the local snapshot up to date; only rows changed since its last sync are fetched
+        source = db_manager
+        if SNAPSHOT_CONFIG['enabled']:
+            logger.info("Syncing training snapshot...")
+            source = TrainingSnapshot(db_manager)
+            source.sync()
+        
+        # The availability check, training and evaluation share one fetch of each dataset
+        data = TrainingDataContext(source)
+        
         # Check data availability
         logger.info("Checking data availability...")
-        if not check_data_availability(db_manager):
+        if not check_data_availability(data):
             logger.error("Insufficient training data. Aborting training.")
             return False
         
-        # Backup existing model
-        backup_existing_model()
-        
         # Initialize and train recommender
         logger.info("Initializing hybrid recommender...")
-        recommender = HybridRecommender(db_manager)
+        recommender = HybridRecommender(data)
         
         logger.info("Training model...")
         start_time = datetime.now()
@@ -109,10 +102,23 @@ def train_model():
         
         logger.info(f"Model training completed in {training_time:.2f} seconds")
         
+        # Report how close approximate neighbor search gets to exact search; small cohorts use exact search anyway
+        collaborative_filter = recommender.collaborative_filter
+        if collaborative_filter.neighbor_backend is not None:
+            logger.info(f"User neighbors built with {collaborative_filter.neighbor_backend} search")
+        if collaborative_filter.neighbor_backend == 'lsh':
+            recall = collaborative_filter.estimate_neighbor_recall(MODEL_CONFIG['ann_recall_sample_size'])
+            if recall is not None:
+                logger.info(f"Neighbor recall@{MODEL_CONFIG['n_neighbors']} (lsh vs exact): {recall:.4f}")
+        elif MODEL_CONFIG['neighbor_backend'] != 'exact' and collaborative_filter.neighbor_backend is not None:
+            logger.info(f"Neighbor recall not applicable: {collaborative_filter.user_item_matrix.shape[0]} students "
+                        f"is below lsh_min_users ({MODEL_CONFIG['lsh_min_users']})")
+        
         # Evaluate model if possible
         logger.info("Evaluating model performance...")
-        evaluator = ModelEvaluator(recommender, db_manager)
+        evaluator = ModelEvaluator(recommender, data)
         evaluation_results = evaluator.evaluate_model()
+        data.close()
         
         if evaluation_results:
             logger.info("Model evaluation results:")
@@ -125,8 +131,8 @@ def train_model():
         logger.info("Saving trained model...")
         model_path = TRAINING_CONFIG['model_path']
         
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        # Ensure directory exists; each save adds a new version and keeps the previous one as the backup
+        os.makedirs(model_path, exist_ok=True)
         
         recommender.save_model(model_path)
         logger.info(f"Model saved to {model_path}")
@@ -149,6 +155,8 @@ def train_model():
         return False
     
     finally:
+        if data is not None:
+            data.close()
         if db_manager:
             db_manager.close()
 
@@ -156,11 +164,12 @@ def should_retrain():
     """Check if model should be retrained based on age"""
     model_path = TRAINING_CONFIG['model_path']
     
-    if not os.path.exists(model_path):
+    if not HybridRecommender.has_artifact(model_path):
         return True
     
-    # Check model age
-    model_age_days = (datetime.now().timestamp() - os.path.getmtime(model_path)) / (24 * 3600)
+    # Check model age; the directory's mtime also moves when marker files like RETRAIN are written
+    created_at = datetime.fromisoformat(HybridRecommender.artifact_info(model_path)['created_at'])
+    model_age_days = (datetime.now() - created_at).total_seconds() / (24 * 3600)
     threshold_days = TRAINING_CONFIG['retrain_threshold_days']
     
     return model_age_days > threshold_days
@@ -173,7 +182,7 @@ def quick_test():
         db_manager = DatabaseManager()
         model_path = TRAINING_CONFIG['model_path']
         
-        if not os.path.exists(model_path):
+        if not HybridRecommender.has_artifact(model_path):
             logger.error("No trained model found for testing")
             return False
         